@@ -4,28 +4,61 @@ from jinja2 import StrictUndefined
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from werkzeug.security import generate_password_hash
-from app.utils.helpers import usd
+from app.utils.helpers import usd, datetimeformat, quote_cache
+from app.utils.shared_quotes import shared_quotes
+from app.utils.market_data import market_data
+from app.utils.price_history import price_history
+from app.utils.http_cache import static_url
+from app.utils.symbols import symbol_index
+from app.utils.rate_limit import rate_limiter
+from app.utils.database import RoutingSession, sqlite_tuning
+from app.utils.metrics import metrics
+from app.utils.quote_deadlines import quote_deadlines
 
 
 # Configure application
 app = Flask(__name__)
 # Custom filter
 app.jinja_env.filters["usd"] = usd
+app.jinja_env.filters["datetimeformat"] = datetimeformat
+
+app.jinja_env.globals["static_url"] = static_url
 
 app.jinja_env.undefined = StrictUndefined
 app.config.from_object(Config)
+quote_cache.init_app(app)
+shared_quotes.init_app(app)
+market_data.init_app(app)
+price_history.init_app(app)
+symbol_index.init_app(app)
+rate_limiter.init_app(app)
+quote_deadlines.init_app(app)
 
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+sqlite_tuning.init_app(app, db)
+metrics.init_app(app, db)
 
 login = LoginManager(app)
 login.login_view = 'login'
 
-from app import views
+from app import views, cli
 from app.utils.debug_utils import reset_db
+from app.utils.price_refresher import price_refresher
+from app.utils.quote_stream import quote_feed
+from app.utils.orders import order_engine
+from app.utils.identity import identity
+from app.utils.leaderboard import leaderboard
+
+price_refresher.init_app(app)
+quote_feed.init_app(app)
+order_engine.init_app(app)
+identity.init_app(app)
+leaderboard.init_app(app)
 
 @app.shell_context_processor
 def make_shell_context():
-    return dict(db=db, generate_password_hash=generate_password_hash, reset_db=reset_db)
+    return dict(db=db, generate_password_hash=generate_password_hash, reset_db=reset_db,
+                quote_cache=quote_cache, market_data=market_data, price_refresher=price_refresher)
 
 
 
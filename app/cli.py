@@ -0,0 +1,179 @@
+import time
+
+import click
+import sqlalchemy as sa
+from app import app, db
+from .utils.account_ledger import reconcile
+from .utils.database import StatementCounter, run_concurrency_benchmark, sqlite_tuning
+from .utils.debug_utils import DEFAULT_START_DATE, generate_dataset
+from .utils.leaderboard import leaderboard
+from .utils.models import User
+from .utils.positions import rebuild_positions
+from .utils.startup import profile_startup
+from .utils.symbols import download_listings, symbol_index, write_listing
+from .utils.upgrade import upgrade_database
+from .utils.valuation import value_all_accounts
+
+
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Create the tables and indexes added since the database was created and backfill them."""
+    counts = upgrade_database()
+    click.echo(f"Created {counts['tables']} tables; merged {counts['merged_positions']} duplicate positions; "
+               f"backfilled {counts['tax_lots']} tax lots from transaction history; "
+               f"adopted {counts['snapshots']} account snapshots")
+
+
+@app.cli.command("rebuild-positions")
+def rebuild_positions_command():
+    """Recompute stock_portfolio and the tax-lot ledger from transaction_history."""
+    count = rebuild_positions()
+    click.echo(f"Rebuilt {count} open positions and their tax lots from transaction history")
+
+
+@app.cli.command("portfolio-report")
+def portfolio_report_command():
+    """Value every account at current prices."""
+    accounts = value_all_accounts()
+    click.echo(f"{'user':>8} {'holdings':>14} {'p&l':>14} {'total':>14}")
+    for user_id, holdings, pnl, total in zip(accounts["user_ids"], accounts["holdings"],
+                                             accounts["pnl"], accounts["total"]):
+        click.echo(f"{user_id:>8} {holdings:>14,.2f} {pnl:>14,.2f} {total:>14,.2f}")
+    click.echo(f"{'all':>8} {accounts['holdings'].sum():>14,.2f} {accounts['pnl'].sum():>14,.2f} "
+               f"{accounts['total'].sum():>14,.2f}")
+
+
+@app.cli.command("leaderboard")
+def leaderboard_command():
+    """Rank every account by total value and print the leaders."""
+    start = time.perf_counter()
+    snapshot = leaderboard.refresh()
+    click.echo(f"Ranked {snapshot.count} accounts in {time.perf_counter() - start:.2f}s")
+    for entry in snapshot.top:
+        click.echo(f"{entry['rank']:>5} {entry['username']:<20} {entry['total']:>14,.2f}")
+
+
+@app.cli.command("profile-startup")
+@click.option("--limit", default=20, show_default=True, help="Modules to list")
+@click.option("--sort", type=click.Choice(["cumulative", "self"]), default="cumulative", show_default=True,
+              help="Cumulative includes the module's own imports")
+def profile_startup_command(limit, sort):
+    """Time a cold start of the app, per imported module and per app module."""
+    modules, app_seconds, total_seconds = profile_startup()
+    click.echo(f"Cold start {total_seconds * 1000:.0f} ms, of which import app {app_seconds * 1000:.0f} ms "
+               f"({len(modules)} modules)")
+
+    column = 1 if sort == "cumulative" else 0
+    click.echo(f"\nSlowest imports by {sort} time:")
+    for name, times in sorted(modules.items(), key=lambda item: item[1][column], reverse=True)[:limit]:
+        click.echo(f"{times[column] * 1000:>9.1f} ms  {'  ' * times[2]}{name}")
+
+    # Self time of the app's own modules is its setup: config, init_app calls and route registration
+    click.echo("\nApp modules by self time:")
+    own = [(name, times) for name, times in modules.items() if name == "app" or name.startswith("app.")]
+    for name, times in sorted(own, key=lambda item: item[1][0], reverse=True)[:limit]:
+        click.echo(f"{times[0] * 1000:>9.1f} ms  {name}")
+
+
+@app.cli.command("reconcile")
+@click.option("--snapshot", is_flag=True, help="Move the snapshots of accounts that reconcile up to now")
+@click.option("--adopt", is_flag=True,
+              help="Take the current state of accounts without a snapshot as their snapshot (upgrade-db does this)")
+@click.option("--limit", default=20, show_default=True, help="Mismatches to list")
+def reconcile_command(snapshot, adopt, limit):
+    """Check every account's cash and holdings against the account ledger."""
+    start = time.perf_counter()
+    result = reconcile(snapshot=snapshot, adopt=adopt)
+    click.echo(f"Replayed {result.entries:,} ledger entries for {result.accounts:,} accounts "
+               f"up to entry {result.watermark} in {time.perf_counter() - start:.2f}s")
+    if snapshot or adopt:
+        click.echo(f"Wrote {result.snapshots:,} snapshots")
+
+    for user_id, expected, actual in result.cash_mismatches[:limit]:
+        click.echo(f"user {user_id}: cash {actual:,.2f}, ledger says {expected:,.2f}")
+    for user_id, symbol, expected, actual in result.position_mismatches[:limit]:
+        click.echo(f"user {user_id}: {actual:g} {symbol}, ledger says {expected:g}")
+    if result.cash_mismatches or result.position_mismatches:
+        raise click.ClickException(f"{len(result.cash_mismatches)} cash and "
+                                   f"{len(result.position_mismatches)} position mismatches")
+
+
+@app.cli.command("bench-sqlite")
+@click.option("--readers", default=8, show_default=True, help="Concurrent reader threads")
+@click.option("--writers", default=2, show_default=True, help="Concurrent writer threads")
+@click.option("--seconds", default=5.0, show_default=True, help="Duration of each run")
+def bench_sqlite_command(readers, writers, seconds):
+    """Compare SQLite read/write throughput with default and tuned settings."""
+    for label, tuned in (("default", False), ("tuned", True)):
+        result = run_concurrency_benchmark(tuned, readers=readers, writers=writers, seconds=seconds,
+                                           pragmas=app.config["SQLITE_PRAGMAS"])
+        click.echo(f"{label:>8}: {result['reads_per_second']:>10,.0f} reads/s "
+                   f"{result['writes_per_second']:>8,.0f} writes/s {result['errors']:>6} lock errors")
+
+
+@app.cli.command("generate-data")
+@click.option("--users", default=1000, show_default=True, help="Number of users")
+@click.option("--transactions", default=100, show_default=True, help="Transactions per user")
+@click.option("--symbols", default=100, show_default=True, help="Number of symbols traded")
+@click.option("--seed", default=0, show_default=True, help="Random seed")
+@click.option("--days", default=365, show_default=True, help="Days of history")
+@click.option("--start-date", type=click.DateTime(formats=["%Y-%m-%d"]),
+              default=DEFAULT_START_DATE.isoformat(), show_default=True, help="Day of the first trades")
+@click.confirmation_option(prompt="This drops and recreates every table. Continue?")
+def generate_data_command(users, transactions, symbols, seed, days, start_date):
+    """Replace the database with a reproducible synthetic dataset."""
+    started = time.perf_counter()
+    counts = generate_dataset(users=users, transactions=transactions, symbols=symbols, seed=seed, days=days,
+                              start_date=start_date.date())
+    click.echo(f"Generated {counts['users']:,} users, {counts['transactions']:,} transactions and "
+               f"{counts['positions']:,} open positions in {time.perf_counter() - started:.1f}s")
+
+
+@app.cli.command("load-symbols")
+def load_symbols_command():
+    """Download the US exchange listings into SYMBOL_LISTING_FILE."""
+    path = app.config["SYMBOL_LISTING_FILE"]
+    count = write_listing(path, download_listings())
+    symbol_index.load(path)
+    click.echo(f"Wrote {count} symbols to {path}")
+
+
+# Most SQL statements each page may run for a signed-in user whose snapshot is cached
+QUERY_BUDGETS = {
+    "/": 3,  # cash + latest transaction id, open positions, realized gain
+    "/history": 2,  # latest transaction id, one page of history
+    "/sell": 2,  # cash + latest transaction id, open positions
+    "/account": 1,  # cash
+    "/buy": 0,
+    "/quote": 0,
+}
+
+
+@app.cli.command("check-query-counts")
+@click.option("--username", default=None, help="User to sign in as (default: the first user)")
+def check_query_counts_command(username):
+    """Check the SQL statements each page runs against QUERY_BUDGETS."""
+    query = sa.select(User.id).order_by(User.id)
+    if username:
+        query = sa.select(User.id).where(User.username == username)
+    user_id = db.session.scalar(query)
+    if user_id is None:
+        raise click.ClickException("no such user")
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+
+    failed = False
+    for path, budget in QUERY_BUDGETS.items():
+        client.get(path)  # Warm the identity and quote caches
+        with StatementCounter([db.engine, sqlite_tuning.writer]) as counter:
+            response = client.get(path)
+        ok = response.status_code == 200 and counter.count <= budget
+        failed |= not ok
+        click.echo(f"{path:<10} {response.status_code} {counter.count:>3} statements "
+                   f"(budget {budget}) {'ok' if ok else 'FAIL'}")
+
+    if failed:
+        raise click.ClickException("pages over their query budget")
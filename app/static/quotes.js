@@ -0,0 +1,62 @@
+// Live prices for every element marked with data-quote-symbol, pushed over /stream/quotes.
+// Opt-in: each open stream holds a server worker, so it only runs after the data-live-quotes
+// button is pressed, and only while the tab is visible.
+document.addEventListener('DOMContentLoaded', function () {
+    const cells = document.querySelectorAll('[data-quote-symbol]');
+    const toggle = document.querySelector('[data-live-quotes]');
+    if (cells.length === 0 || !toggle || !window.EventSource) {
+        return;
+    }
+    toggle.hidden = false;
+
+    const symbols = new Set();
+    cells.forEach(function (cell) {
+        symbols.add(cell.dataset.quoteSymbol.toUpperCase());
+    });
+
+    const formatter = new Intl.NumberFormat('en-US', { style: 'currency', currency: 'USD' });
+    let wanted = false;
+    let source = null;
+
+    function open() {
+        if (source || !wanted || document.visibilityState === 'hidden') {
+            return;
+        }
+        source = new EventSource('/stream/quotes?symbols=' + encodeURIComponent(Array.from(symbols).join(',')));
+        source.addEventListener('quote', function (event) {
+            const quote = JSON.parse(event.data);
+            cells.forEach(function (cell) {
+                if (cell.dataset.quoteSymbol.toUpperCase() === quote.symbol) {
+                    cell.textContent = formatter.format(quote.price);
+                }
+            });
+        });
+    }
+
+    function close() {
+        if (source) {
+            source.close();
+            source = null;
+        }
+    }
+
+    toggle.addEventListener('click', function () {
+        wanted = !wanted;
+        toggle.textContent = wanted ? 'Live prices: on' : 'Live prices: off';
+        if (wanted) {
+            open();
+        } else {
+            close();
+        }
+    });
+
+    // Release the connection while the tab is in the background and once the page is left
+    document.addEventListener('visibilitychange', function () {
+        if (document.visibilityState === 'hidden') {
+            close();
+        } else {
+            open();
+        }
+    });
+    window.addEventListener('pagehide', close);
+});
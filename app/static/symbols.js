@@ -0,0 +1,41 @@
+// Symbol suggestions for inputs marked with data-symbol-autocomplete, from /symbols
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('[data-symbol-autocomplete]').forEach(function (input) {
+        const options = document.getElementById(input.getAttribute('list'));
+        if (!options) {
+            return;
+        }
+
+        let timer = null;
+        let controller = null;
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            const query = input.value.trim();
+            if (query === '') {
+                options.replaceChildren();
+                return;
+            }
+
+            // Wait for a pause in typing, and drop any request a newer keystroke has made stale
+            timer = setTimeout(function () {
+                if (controller) {
+                    controller.abort();
+                }
+                controller = new AbortController();
+
+                fetch('/symbols?q=' + encodeURIComponent(query), { signal: controller.signal })
+                    .then(function (response) { return response.ok ? response.json() : []; })
+                    .then(function (matches) {
+                        options.replaceChildren(...matches.map(function (match) {
+                            const option = document.createElement('option');
+                            option.value = match.symbol;
+                            option.label = match.name;
+                            return option;
+                        }));
+                    })
+                    .catch(function () {});
+            }, 100);
+        });
+    });
+});
@@ -0,0 +1,102 @@
+// Submit forms marked with data-trade="buy" or "sell" to /api/<side> and update the page in place
+document.addEventListener('DOMContentLoaded', function () {
+    const forms = document.querySelectorAll('form[data-trade]');
+    if (forms.length === 0 || !window.fetch) {
+        return;
+    }
+
+    const formatter = new Intl.NumberFormat('en-US', { style: 'currency', currency: 'USD' });
+
+    // Same place and look as the flashed messages of a full page load
+    function showStatus(message, failed) {
+        let header = document.getElementById('trade-status');
+        if (!header) {
+            header = document.createElement('header');
+            header.id = 'trade-status';
+            header.innerHTML = '<div class="alert mb-0 text-center" role="alert"></div>';
+            document.querySelector('main').before(header);
+        }
+        const alert = header.firstElementChild;
+        alert.classList.toggle('alert-primary', !failed);
+        alert.classList.toggle('alert-danger', failed);
+        alert.textContent = message;
+    }
+
+    function describe(trade) {
+        const verb = trade.side === 'buy' ? 'Bought' : 'Sold';
+        let message = verb + ' ' + trade.quantity + ' ' + trade.symbol + ' at ' + formatter.format(trade.price) +
+            '. Cash: ' + formatter.format(trade.cash) + '.';
+        if (trade.realized_gain !== null) {
+            message += ' Realized gain: ' + formatter.format(trade.realized_gain) + '.';
+        }
+        return message;
+    }
+
+    // Sell page: update or remove the position's row
+    function updatePosition(position) {
+        const row = document.querySelector('[data-position="' + CSS.escape(position.symbol) + '"]');
+        if (!row) {
+            return;
+        }
+        if (position.quantity <= 0) {
+            row.remove();
+            return;
+        }
+        row.querySelector('[data-position-quantity]').textContent = position.quantity;
+        row.querySelector('[data-position-price]').textContent = formatter.format(position.average_price);
+        const input = row.querySelector('input[name="quantity"]');
+        if (input) {
+            input.max = position.quantity;
+        }
+    }
+
+    forms.forEach(function (form) {
+        form.addEventListener('submit', function (event) {
+            event.preventDefault();
+            const fields = form.elements;
+            const symbol = (fields.symbol || fields.stock_id).value;
+            const quantityInput = fields.shares || fields.quantity;
+            const button = form.querySelector('button[type="submit"]');
+            button.disabled = true;
+
+            fetch('/api/' + form.dataset.trade, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ symbol: symbol, quantity: quantityInput.value }),
+            })
+                .then(function (response) {
+                    // Sent to the login page because the session expired: nothing was traded, so submit normally
+                    if (response.redirected && new URL(response.url).pathname === '/login') {
+                        form.submit();
+                        return;
+                    }
+                    // Any other page (e.g. a proxy's 5xx) may come after the order went through: not resubmitted
+                    if (!(response.headers.get('Content-Type') || '').startsWith('application/json')) {
+                        showStatus('The server did not confirm the order. Check your history before trying again.', true);
+                        return;
+                    }
+                    return response.json().then(function (body) {
+                        if (!response.ok) {
+                            showStatus(body.error, true);
+                            return;
+                        }
+                        // Still executing when the server stopped waiting: it will go through, so don't resubmit
+                        if (response.status === 202) {
+                            showStatus(body.message, false);
+                            return;
+                        }
+                        showStatus(describe(body), false);
+                        updatePosition(body.position);
+                        quantityInput.value = '';
+                    });
+                })
+                .catch(function () {
+                    // Not resubmitted: the order may have gone through before the connection dropped
+                    showStatus('Could not reach the server. Check your history before trying again.', true);
+                })
+                .finally(function () {
+                    button.disabled = false;
+                });
+        });
+    });
+});
@@ -0,0 +1,175 @@
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import sqlalchemy as sa
+
+from .database import bulk_insert
+from .models import AccountEntry, AccountSnapshot, AccountSnapshotPosition, StockPortfolio, User
+from app import db
+
+# Cash differences below this are float rounding, not a broken balance
+CASH_TOLERANCE = 0.005
+# User ids per DELETE ... WHERE user_id IN (...), below SQLite's bound parameter limit
+DELETE_CHUNK_SIZE = 900
+
+# What reconcile() found: mismatches are (user_id, expected, actual) and (user_id, symbol, expected, actual)
+Reconciliation = namedtuple("Reconciliation", [
+    "watermark", "accounts", "entries", "cash_mismatches", "position_mismatches", "snapshots",
+])
+
+
+def record_entry(user_id, kind, cash_delta, stock_id=None, quantity_delta=0, transaction_id=None,
+                 created_at=None):
+    """Append one entry to the account ledger, in the caller's transaction."""
+    values = {"user_id": user_id, "kind": kind, "stock_id": stock_id, "cash_delta": cash_delta,
+              "quantity_delta": quantity_delta, "transaction_id": transaction_id}
+    if created_at is not None:
+        values["created_at"] = created_at
+    db.session.execute(sa.insert(AccountEntry.__table__).values(values))
+
+
+def _fetch(connection, query, *fields):
+    """
+    Rows of query as a NumPy structured array with the given (name, dtype) fields.
+
+    The array is built straight from the driver's tuples, skipping SQLAlchemy's
+    Row objects, which would otherwise cost more than reading the rows.
+    """
+    result = connection.execute(query)
+    try:
+        return np.array(result.cursor.fetchall(), dtype=list(fields))
+    finally:
+        result.close()
+
+
+def _sum_by_account(account_ids, user_ids, values):
+    """Sum values per account, aligned with the sorted account_ids."""
+    index = np.searchsorted(account_ids, user_ids)
+    known = index < len(account_ids)
+    known[known] = account_ids[index[known]] == user_ids[known]
+    return np.bincount(index[known], weights=values[known], minlength=len(account_ids))
+
+
+def reconcile(snapshot=False, adopt=False):
+    """
+    Check every account's cash and holdings against the account ledger.
+
+    An account's expected state is its latest snapshot plus the entries
+    appended after it, so only those entries are read, for all accounts in
+    one query, and summed per account and per (account, symbol) with NumPy.
+    Everything is read in one SQLite read transaction, so trades committed
+    meanwhile cannot cause false mismatches.
+
+    snapshot=True moves the snapshots of accounts that reconcile up to the
+    last entry read, so the next run replays less. adopt=True takes the
+    current state of accounts that have no snapshot yet as their snapshot;
+    run it once for accounts created before the ledger existed. Returns a
+    Reconciliation.
+    """
+    entries = AccountEntry.__table__
+    snapshots = AccountSnapshot.__table__
+    snapshot_positions = AccountSnapshotPosition.__table__
+    users = User.__table__
+    portfolio = StockPortfolio.__table__
+
+    symbol = sa.func.upper(sa.func.coalesce(entries.c.stock_id, ""))
+    with db.engine.connect() as connection:
+        # pysqlite starts no transaction for SELECTs; an explicit one reads every table at the same WAL snapshot
+        connection.exec_driver_sql("BEGIN")
+        watermark = connection.scalar(sa.select(sa.func.max(entries.c.id))) or 0
+        accounts = _fetch(connection, sa.select(users.c.id, users.c.cash).order_by(users.c.id),
+                          ("user_id", "i8"), ("cash", "f8"))
+        snapshotted = _fetch(connection, sa.select(snapshots.c.user_id, snapshots.c.cash),
+                             ("user_id", "i8"), ("cash", "f8"))
+        snapshot_held = _fetch(connection, sa.select(snapshot_positions.c.user_id,
+                                                     sa.func.upper(snapshot_positions.c.stock_id),
+                                                     snapshot_positions.c.quantity),
+                               ("user_id", "i8"), ("symbol", "U10"), ("quantity", "f8"))
+        # Driven from users so each account's entries after its snapshot are one range of ix_account_entries_user_id
+        since = _fetch(connection, sa.select(entries.c.user_id, symbol, entries.c.cash_delta, entries.c.quantity_delta)
+                       .select_from(users.outerjoin(snapshots, snapshots.c.user_id == users.c.id)
+                                    .join(entries, sa.and_(entries.c.user_id == users.c.id,
+                                                           entries.c.id > sa.func.coalesce(snapshots.c.entry_id, 0))))
+                       .where(entries.c.id <= watermark),
+                       ("user_id", "i8"), ("symbol", "U10"), ("cash", "f8"), ("quantity", "f8"))
+        held = _fetch(connection, sa.select(portfolio.c.user_id, sa.func.upper(portfolio.c.stock_id),
+                                            portfolio.c.quantity),
+                      ("user_id", "i8"), ("symbol", "U10"), ("quantity", "f8"))
+
+    account_ids = accounts["user_id"]
+    cash = accounts["cash"]
+
+    # Expected cash: snapshot plus the entries since
+    expected_cash = (_sum_by_account(account_ids, snapshotted["user_id"], snapshotted["cash"])
+                     + _sum_by_account(account_ids, since["user_id"], since["cash"]))
+
+    # Expected holdings, keyed by (account, symbol) together with the actual ones
+    trades = since[since["symbol"] != ""]
+    expected_users = np.concatenate([snapshot_held["user_id"], trades["user_id"]])
+    symbols, symbol_codes = np.unique(np.concatenate([snapshot_held["symbol"], trades["symbol"], held["symbol"]]),
+                                      return_inverse=True)
+    width = max(len(symbols), 1)
+    keys, key_index = np.unique(np.concatenate([expected_users, held["user_id"]]) * width + symbol_codes,
+                                return_inverse=True)
+    # bincount returns integers rather than floats when there is nothing to count
+    expected_held = np.bincount(key_index[:len(expected_users)],
+                                weights=np.concatenate([snapshot_held["quantity"], trades["quantity"]]),
+                                minlength=len(keys)).astype(np.float64)
+    actual_held = np.bincount(key_index[len(expected_users):], weights=held["quantity"],
+                              minlength=len(keys)).astype(np.float64)
+    key_users = keys // width
+    key_symbols = symbols[keys % width] if len(symbols) else np.empty(0, dtype=str)
+
+    # Accounts without a snapshot are either checked from their first entry or adopted as they are
+    unsnapshotted = ~np.isin(account_ids, snapshotted["user_id"])
+    if adopt:
+        expected_cash[unsnapshotted] = cash[unsnapshotted]
+        adopted_keys = np.isin(key_users, account_ids[unsnapshotted])
+        expected_held[adopted_keys] = actual_held[adopted_keys]
+
+    cash_bad = np.abs(expected_cash - cash) > CASH_TOLERANCE
+    held_bad = ~np.isclose(expected_held, actual_held, rtol=0, atol=1e-9)
+    cash_mismatches = list(zip(account_ids[cash_bad].tolist(), expected_cash[cash_bad].tolist(),
+                               cash[cash_bad].tolist()))
+    position_mismatches = list(zip(key_users[held_bad].tolist(), key_symbols[held_bad].tolist(),
+                                   expected_held[held_bad].tolist(), actual_held[held_bad].tolist()))
+
+    written = 0
+    if snapshot or adopt:
+        clean = ~cash_bad & ~np.isin(account_ids, key_users[held_bad])
+        if not snapshot:
+            clean &= unsnapshotted
+        written = _write_snapshots(account_ids[clean], expected_cash[clean], watermark,
+                                   key_users, key_symbols, expected_held, len(account_ids))
+
+    return Reconciliation(watermark, len(account_ids), len(since), cash_mismatches, position_mismatches, written)
+
+
+def _write_snapshots(user_ids, cash, watermark, key_users, key_symbols, held, account_count):
+    """Replace the snapshots of user_ids with their reconciled state as of entry watermark."""
+    if not len(user_ids):
+        return 0
+    snapshots = AccountSnapshot.__table__
+    snapshot_positions = AccountSnapshotPosition.__table__
+
+    if len(user_ids) == account_count:
+        db.session.execute(sa.delete(snapshot_positions))
+        db.session.execute(sa.delete(snapshots))
+    else:
+        ids = user_ids.tolist()
+        for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+            chunk = ids[start:start + DELETE_CHUNK_SIZE]
+            db.session.execute(sa.delete(snapshot_positions).where(snapshot_positions.c.user_id.in_(chunk)))
+            db.session.execute(sa.delete(snapshots).where(snapshots.c.user_id.in_(chunk)))
+
+    taken_at = datetime.now().isoformat(sep=" ")
+    bulk_insert(db.session, snapshots, ("user_id", "entry_id", "cash", "taken_at"),
+                [(user_id, watermark, balance, taken_at) for user_id, balance in zip(user_ids.tolist(), cash.tolist())])
+    positions = np.isin(key_users, user_ids) & (held != 0)
+    # Sums come back as floats; whole share counts are stored as integers like everywhere else
+    quantities = [int(quantity) if quantity.is_integer() else quantity for quantity in held[positions].tolist()]
+    bulk_insert(db.session, snapshot_positions, ("user_id", "stock_id", "quantity"),
+                list(zip(key_users[positions].tolist(), key_symbols[positions].tolist(), quantities)))
+    db.session.commit()
+    return len(user_ids)
@@ -0,0 +1,224 @@
+import os
+import random
+import tempfile
+import threading
+import time
+
+import sqlalchemy as sa
+from flask_sqlalchemy.session import Session
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """Run PRAGMA name = value for each setting on a new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def begin_immediate(engine):
+    """
+    Make every transaction on engine start with BEGIN IMMEDIATE.
+
+    The write lock is then taken when the transaction starts, where
+    busy_timeout applies, instead of at the first write, where SQLite may fail
+    straight away with "database is locked" if another writer got in first.
+    """
+    @sa.event.listens_for(engine, "connect")
+    def disable_pysqlite_begin(dbapi_connection, connection_record):
+        # Stop pysqlite emitting its own BEGIN so the one below is used
+        dbapi_connection.isolation_level = None
+
+    @sa.event.listens_for(engine, "begin")
+    def do_begin(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def create_writer_engine(url, pragmas):
+    """A one-connection engine: writes from every thread in the process queue for it."""
+    engine = sa.create_engine(url, pool_size=1, max_overflow=0, pool_timeout=60)
+    sa.event.listen(engine, "connect", lambda dbapi_connection, record: apply_pragmas(dbapi_connection, pragmas))
+    begin_immediate(engine)
+    return engine
+
+
+def bulk_insert(session, table, columns, rows, chunk_size=50000):
+    """
+    INSERT rows (tuples in columns order) into table in chunks of chunk_size.
+    columns must be listed in the table's own column order.
+
+    The Core INSERT is compiled once and each chunk goes straight to the
+    driver's executemany. That skips SQLAlchemy's per-row parameter
+    processing, which otherwise costs more than SQLite's own work. Values
+    must already be in their stored form (e.g. datetimes as SQLite text).
+    """
+    stmt = sa.insert(table).values({column: sa.bindparam(column) for column in columns})
+    connection = session.connection(bind_arguments={"clause": stmt})
+    compiled = stmt.compile(dialect=connection.dialect)
+    if tuple(compiled.positiontup) != tuple(columns):
+        raise ValueError(f"columns must be in table order: {compiled.positiontup}")
+    sql = str(compiled)
+    for chunk in range(0, len(rows), chunk_size):
+        connection.exec_driver_sql(sql, rows[chunk:chunk + chunk_size])
+
+
+class SQLiteTuning:
+    """
+    SQLite settings for concurrent use.
+
+    Every pooled connection gets SQLITE_PRAGMAS (WAL journal, busy_timeout,
+    synchronous, mmap_size, cache_size). In WAL mode readers never block the
+    writer or each other, so reads use the normal engine's pool of
+    SQLITE_READ_POOL_SIZE connections. With SQLITE_SERIALIZED_WRITER set, a
+    session is switched to a separate single-connection writer engine from its
+    first INSERT/UPDATE/DELETE or flush until its transaction ends. The writer
+    starts its transactions with BEGIN IMMEDIATE, so writers queue on the
+    pool (in-process) and on busy_timeout (across processes) rather than
+    failing with "database is locked".
+    """
+
+    def __init__(self):
+        self.writer = None
+
+    def init_app(self, app, db):
+        url = app.config["SQLALCHEMY_DATABASE_URI"]
+        if not url.startswith("sqlite"):
+            return
+        pragmas = app.config.get("SQLITE_PRAGMAS", {})
+
+        with app.app_context():
+            engine = db.engine
+
+        @sa.event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+
+        # An in-memory database is private to its connection, so it can't have a separate writer
+        if app.config.get("SQLITE_SERIALIZED_WRITER") and engine.url.database not in (None, "", ":memory:"):
+            self.writer = create_writer_engine(engine.url, pragmas)
+
+        app.extensions["sqlite_tuning"] = self
+
+
+sqlite_tuning = SQLiteTuning()
+
+
+class RoutingSession(Session):
+    """Session that sends reads to the pooled engine and writes to the serialized writer."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        writer = sqlite_tuning.writer
+        if bind is None and writer is not None:
+            if self.info.get("writing") or self._flushing or isinstance(clause, sa.sql.dml.UpdateBase):
+                # Stay on the writer until the transaction ends so later reads see our writes
+                self.info["writing"] = True
+                return writer
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@sa.event.listens_for(RoutingSession, "after_transaction_end")
+def _leave_writer(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("writing", None)
+
+
+def run_concurrency_benchmark(tuned, readers=8, writers=2, seconds=5.0, rows=10000, pragmas=None,
+                              path=None):
+    """
+    Hammer a scratch SQLite database with concurrent readers and writers.
+
+    tuned=False uses a plain engine with pysqlite defaults (rollback journal,
+    deferred transactions); tuned=True applies pragmas, uses a read pool and
+    sends writes through a single BEGIN IMMEDIATE writer connection, as the
+    app does. Returns a dict of read/write counts, rates and lock errors.
+    """
+    path = path or os.path.join(tempfile.mkdtemp(), "bench.db")
+    url = f"sqlite:///{path}"
+
+    setup = sa.create_engine(url)
+    with setup.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS bench")
+        conn.exec_driver_sql("CREATE TABLE bench (id INTEGER PRIMARY KEY, user_id INTEGER, value FLOAT)")
+        conn.exec_driver_sql("CREATE INDEX ix_bench_user ON bench (user_id)")
+        conn.exec_driver_sql("INSERT INTO bench (user_id, value) VALUES " +
+                             ",".join(f"({i % 100}, {i})" for i in range(rows)))
+    setup.dispose()
+
+    if tuned:
+        pragmas = pragmas or {}
+        read_engine = sa.create_engine(url, pool_size=readers, max_overflow=0)
+        sa.event.listen(read_engine, "connect", lambda dbapi_connection, record: apply_pragmas(dbapi_connection, pragmas))
+        write_engine = create_writer_engine(url, pragmas)
+    else:
+        read_engine = write_engine = sa.create_engine(url, pool_size=readers + writers, max_overflow=0)
+
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def read_loop():
+        rng = random.Random()
+        done = errors = 0
+        while time.monotonic() < deadline:
+            try:
+                with read_engine.connect() as conn:
+                    conn.execute(sa.text("SELECT sum(value) FROM bench WHERE user_id = :u"),
+                                 {"u": rng.randrange(100)}).scalar()
+                done += 1
+            except sa.exc.OperationalError:
+                errors += 1
+        with lock:
+            counts["reads"] += done
+            counts["errors"] += errors
+
+    def write_loop():
+        rng = random.Random()
+        done = errors = 0
+        while time.monotonic() < deadline:
+            try:
+                with write_engine.begin() as conn:
+                    user_id = rng.randrange(100)
+                    conn.execute(sa.text("SELECT sum(value) FROM bench WHERE user_id = :u"), {"u": user_id})
+                    conn.execute(sa.text("UPDATE bench SET value = value + 1 WHERE id = :i"),
+                                 {"i": rng.randrange(1, rows + 1)})
+                    conn.execute(sa.text("INSERT INTO bench (user_id, value) VALUES (:u, 1)"), {"u": user_id})
+                done += 1
+            except sa.exc.OperationalError:
+                errors += 1
+        with lock:
+            counts["writes"] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=read_loop) for _ in range(readers)]
+    threads += [threading.Thread(target=write_loop) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    read_engine.dispose()
+    write_engine.dispose()
+
+    counts["reads_per_second"] = counts["reads"] / seconds
+    counts["writes_per_second"] = counts["writes"] / seconds
+    return counts
+
+
+class StatementCounter:
+    """Counts the SQL statements executed on some engines while it is open."""
+
+    def __init__(self, engines):
+        self.engines = [engine for engine in engines if engine is not None]
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            sa.event.listen(engine, "after_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            sa.event.remove(engine, "after_cursor_execute", self._count)
@@ -1,8 +1,20 @@
-from .models import User, TransactionHistory, StockPortfolio
+from .account_ledger import reconcile
+from .database import bulk_insert
+from .identity import identity
+from .models import AccountEntry, User, TransactionHistory
+from .positions import rebuild_positions, replay_trades, write_ledger
+from .symbols import symbol_index
 import random
-from _datetime import datetime, timedelta
+from _datetime import date, datetime, timedelta
+import numpy as np
+from werkzeug.security import generate_password_hash
 from app import db
 
+# Symbols traded by generated users when no listing is loaded
+DEFAULT_SYMBOLS = ("AAPL", "AMZN", "GOOGL", "META", "MSFT", "NFLX", "NVDA", "TSLA")
+# First day of generated trades unless another is given, fixed so a seed always gives the same data
+DEFAULT_START_DATE = date(2024, 1, 1)
+
 def reset_db():
     """
     Resets the database by dropping all tables, creating them again,
@@ -10,6 +22,7 @@ def reset_db():
     """
     db.drop_all()
     db.create_all()
+    identity.clear()
 
     # Create dummy users
     user1 = User(username="testuser1", cash=10000.0)
@@ -47,20 +60,110 @@ def reset_db():
             )
             db.session.add(transaction)
 
-            # Update StockPortfolio (simplified - you might need more complex logic)
-            portfolio_entry = StockPortfolio.query.filter_by(user_id=user.id, stock_id=stock_id).first()
-            if portfolio_entry:
-                if transaction_type == "buy":
-                    portfolio_entry.quantity += quantity
-                elif transaction_type == "sell":
-                    portfolio_entry.quantity -= quantity
-            elif transaction_type == "buy":
-                portfolio_entry = StockPortfolio(
-                    user_id=user.id,
-                    stock_id=stock_id,
-                    quantity=quantity,
-                    buy_price=price  # Or some average if needed
-                )
-                db.session.add(portfolio_entry)
-
-    db.session.commit()
\ No newline at end of file
+    db.session.commit()
+
+    # Positions and tax lots are whatever the dummy history implies, and the current
+    # state of every account is its account ledger snapshot, so reconcile starts clean
+    rebuild_positions()
+    reconcile(adopt=True)
+
+
+def generate_dataset(users=1000, transactions=100, symbols=100, seed=0, days=365, chunk_size=50000,
+                     password="password", start_date=DEFAULT_START_DATE):
+    """
+    Replace the database contents with a reproducible synthetic dataset.
+
+    Creates users (named user0000001, ... with the same password) with
+    transactions trades each, spread over the days days from start_date and
+    across symbols symbols from the loaded listing. Sells never exceed the shares
+    held and buys never overdraw cash: each user opens with at least $10,000,
+    plus whatever their trades needed. Cash, stock_portfolio, the tax-lot
+    ledger and the account ledger (an opening entry per user, then one entry
+    per trade) are the result of replaying the trades. The data is identical
+    for the same arguments and symbol listing. Returns the number of users,
+    transactions and open positions written.
+    """
+    rng = np.random.default_rng(seed)
+    universe = sorted(symbol_index.names) or list(DEFAULT_SYMBOLS)
+    universe = [universe[i] for i in np.sort(rng.choice(len(universe), min(symbols, len(universe)), replace=False))]
+    base_prices = np.exp(rng.normal(np.log(100), 1, len(universe)))
+
+    # Every random draw is made up front, vectorized; only the replay below is per row
+    count = users * transactions
+    user_ids = np.repeat(np.arange(1, users + 1), transactions)
+    offsets = rng.integers(0, days * 86400 * 10**6, count)  # Microseconds into the period
+    offsets = offsets[np.lexsort((offsets, user_ids))]  # Each user's trades in time order
+    symbol_ids = rng.integers(0, len(universe), count)
+    sells = rng.random(count) < 0.3
+    buy_quantities = rng.integers(1, 101, count)
+    sell_fractions = rng.random(count)
+    prices = np.round(base_prices[symbol_ids] * np.exp(rng.normal(0, 0.1, count)), 2)
+
+    # Timestamps in the text format SQLAlchemy stores DateTime columns in on SQLite
+    start = np.datetime64(start_date, "us")
+    times = np.char.replace(np.datetime_as_string(start + offsets.astype("timedelta64[us]")), "T", " ")
+
+    trades = []
+    opening = {}  # user id -> opening balance
+    cash = {}
+    holdings = {}  # symbol id -> shares held by the current user
+    balance = lowest = 0.0
+    user_ids = user_ids.tolist()
+    for i, (user_id, symbol_id, sell, quantity, fraction, price, transaction_time) in enumerate(zip(
+            user_ids, symbol_ids.tolist(), sells.tolist(), buy_quantities.tolist(),
+            sell_fractions.tolist(), prices.tolist(), times.tolist())):
+        held = holdings.get(symbol_id, 0)
+        if sell and held:
+            # Sell part of what is held
+            quantity = max(1, int(held * fraction))
+            holdings[symbol_id] = held - quantity
+            balance += quantity * price
+            transaction_type = "Sale"
+        else:
+            holdings[symbol_id] = held + quantity
+            balance -= quantity * price
+            lowest = min(lowest, balance)
+            transaction_type = "buy"
+
+        trades.append((i + 1, user_id, universe[symbol_id], transaction_type, quantity, price, transaction_time))
+
+        # Last trade of this user: settle their cash
+        if i + 1 == count or user_ids[i + 1] != user_id:
+            opening[user_id] = 10000.0 - lowest
+            cash[user_id] = opening[user_id] + balance
+            holdings = {}
+            balance = lowest = 0.0
+
+    lots, gains, summary, positions = replay_trades(trades)
+
+    db.drop_all()
+    db.create_all()
+    identity.clear()
+
+    # Hashing is deliberately slow, so every generated user shares one hash
+    password_hash = generate_password_hash(password)
+    user_rows = [(user_id, f"user{user_id:07d}", password_hash, cash.get(user_id, 10000.0))
+                 for user_id in range(1, users + 1)]
+
+    bulk_insert(db.session, User.__table__, ("id", "username", "password_hash", "cash"), user_rows, chunk_size)
+    bulk_insert(db.session, TransactionHistory.__table__,
+                ("id", "user_id", "stock_id", "price", "transaction_type", "quantity", "transaction_time"),
+                [(id, user_id, symbol, price, transaction_type, quantity, transaction_time)
+                 for id, user_id, symbol, transaction_type, quantity, price, transaction_time in trades],
+                chunk_size)
+    write_ledger(lots, gains, summary, positions, chunk_size)
+
+    # Opening balances get entry ids 1..users and trade i gets users + i, so every account opens first
+    opened_at = str(start).replace("T", " ")
+    entry_rows = [(user_id, user_id, "opening", None, opening.get(user_id, 10000.0), 0, None, opened_at)
+                  for user_id in range(1, users + 1)]
+    entry_rows += [(users + id, user_id, "buy" if transaction_type == "buy" else "sell", symbol,
+                    -quantity * price if transaction_type == "buy" else quantity * price,
+                    quantity if transaction_type == "buy" else -quantity, id, transaction_time)
+                   for id, user_id, symbol, transaction_type, quantity, price, transaction_time in trades]
+    bulk_insert(db.session, AccountEntry.__table__,
+                ("id", "user_id", "kind", "stock_id", "cash_delta", "quantity_delta", "transaction_id", "created_at"),
+                entry_rows, chunk_size)
+    db.session.commit()
+
+    return {"users": users, "transactions": count, "positions": len(positions)}
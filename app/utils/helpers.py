@@ -1,7 +1,12 @@
-import yfinance as yf
-
 from flask import redirect, render_template, request, session
 from functools import wraps
+from .market_data import QuoteError, market_data
+from .quote_cache import QuoteCache
+from .shared_quotes import shared_quotes
+
+
+# Shared by every caller of lookup(); configured from the app in app/__init__.py
+quote_cache = QuoteCache()
 
 
 def apology(message, code=400):
@@ -29,19 +34,67 @@ def apology(message, code=400):
     return render_template("apology.html", top=code, bottom=escape(message)), code
 
 
+def _fetch_quote(symbol):
+    quote = market_data.get_quote(symbol)
+    shared_quotes.publish({symbol: quote})
+    return quote
+
+
+def _fetch_quotes(symbols):
+    quotes = market_data.get_quotes(symbols)
+    shared_quotes.publish(quotes)
+    return quotes
+
+
 def lookup(symbol):
-    """Look up quote for symbol."""
+    """
+    Look up quote for symbol, going upstream only if neither the shared table nor the cache has it.
 
-    # Prepare API request
+    Returns None for a symbol the provider cannot price. UpstreamBudgetExceeded
+    is raised, not turned into None: the symbol may well exist.
+    """
     symbol = symbol.upper()
-    stock = yf.Ticker(symbol)
-    price = stock.history(period="7d")["Close"].iloc[-1]
+    quote = shared_quotes.get(symbol)
+    if quote is not None:
+        return quote
+    try:
+        return quote_cache.get(symbol, _fetch_quote)
+    except QuoteError:
+        return None
+
 
-    price = float(price)
+def lookup_many(symbols):
+    """
+    Look up quotes for several symbols at once.
 
-    return {"price" : round(price, 2), "symbol" : symbol}
+    Symbols in the shared quote table or the cache are served from there and
+    the rest are fetched in one multi-ticker request, which counts as one call
+    against the upstream budget. Returns {symbol: quote}, with None for
+    symbols that could not be priced; UpstreamBudgetExceeded is raised.
+    """
+    quotes = {}
+    missing = []
+    for symbol in symbols:
+        symbol = symbol.upper()
+        quote = shared_quotes.get(symbol)
+        if quote is None:
+            missing.append(symbol)
+        else:
+            quotes[symbol] = quote
+    if not missing:
+        return quotes
+    try:
+        quotes.update(quote_cache.get_many(missing, _fetch_quotes))
+    except QuoteError:
+        quotes.update(dict.fromkeys(missing))
+    return quotes
 
 
 def usd(value):
     """Format value as USD."""
-    return f"${value:,.2f}"
\ No newline at end of file
+    return f"${value:,.2f}"
+
+
+def datetimeformat(value, fmt="%B %d %Y at %I:%M %p"):
+    """Format a datetime for display."""
+    return value.strftime(fmt)
\ No newline at end of file
@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+
+import sqlalchemy as sa
+
+from .models import TransactionHistory
+from app import db
+
+# Columns written to every export, in order
+EXPORT_COLUMNS = ("id", "stock_id", "transaction_type", "quantity", "price", "transaction_time")
+
+
+def history_batches(user_id, batch_size=1000):
+    """
+    Yield the user's transactions oldest first, batch_size rows at a time.
+
+    Rows are fetched from the cursor as they are needed (yield_per), so only
+    one batch is in memory however long the history is.
+    """
+    history = TransactionHistory.__table__
+    result = db.session.execute(
+        sa.select(*(history.c[name] for name in EXPORT_COLUMNS))
+        .where(history.c.user_id == user_id)
+        .order_by(history.c.transaction_time, history.c.id)
+        .execution_options(yield_per=batch_size)
+    )
+    yield from result.partitions()
+
+
+def export_csv(user_id, batch_size=1000):
+    """Generate the user's history as CSV, one chunk of text per batch."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    # The header goes out before the query runs, so the download starts straight away
+    yield buffer.getvalue()
+
+    for batch in history_batches(user_id, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows((id, stock_id, transaction_type, quantity, price, transaction_time.isoformat())
+                         for id, stock_id, transaction_type, quantity, price, transaction_time in batch)
+        yield buffer.getvalue()
+
+
+def export_jsonl(user_id, batch_size=1000):
+    """Generate the user's history as JSON Lines, one chunk of text per batch."""
+    for batch in history_batches(user_id, batch_size):
+        yield "".join(
+            json.dumps({
+                "id": id,
+                "stock_id": stock_id,
+                "transaction_type": transaction_type,
+                "quantity": quantity,
+                "price": price,
+                "transaction_time": transaction_time.isoformat(),
+            }) + "\n"
+            for id, stock_id, transaction_type, quantity, price, transaction_time in batch
+        )
+
+
+# format -> (mimetype, generator)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", export_csv),
+    "jsonl": ("application/x-ndjson", export_jsonl),
+}
@@ -0,0 +1,75 @@
+import hashlib
+import os
+from functools import wraps
+
+from flask import current_app, make_response, request, session, url_for
+
+# Fingerprinted static URLs never change content, so browsers may keep them for a year
+STATIC_IMMUTABLE = "public, max-age=31536000, immutable"
+# Static files requested without a fingerprint (e.g. a browser probing /static/favicon.ico)
+STATIC_DEFAULT = "public, max-age=3600"
+# Per-user pages: cacheable by the browser only, revalidated with their ETag on every visit
+PRIVATE_REVALIDATE = "private, no-cache"
+# Everything else: never stored
+NO_STORE = "no-cache, no-store, must-revalidate"
+
+_fingerprints = {}  # filename -> (mtime, digest)
+
+
+def static_url(filename):
+    """URL of a static file with a content fingerprint, so it can be cached indefinitely."""
+    path = os.path.join(current_app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+
+    cached = _fingerprints.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = _fingerprints[filename] = (mtime, hashlib.md5(f.read()).hexdigest()[:12])
+
+    return url_for("static", filename=filename, v=cached[1])
+
+
+def etag_cached(key):
+    """
+    Serve a GET view with a strong ETag built from key(), which must be cheap.
+
+    key() should return everything the page depends on (for example the user's
+    latest transaction id). When the browser already holds a page with the same
+    ETag the view is not called at all and a 304 is returned. A view can keep
+    one response out of the cache by setting its own Cache-Control.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pending flash messages are shown once, so that page must be rendered
+            if request.method != "GET" or session.get("_flashes"):
+                return view(*args, **kwargs)
+
+            parts = (request.endpoint, request.query_string, *key())
+            etag = hashlib.sha1(repr(parts).encode()).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or "Cache-Control" in response.headers:
+                    return response
+
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = PRIVATE_REVALIDATE
+            response.vary.add("Cookie")
+            return response
+        return wrapper
+    return decorator
+
+
+def apply_cache_policy(response):
+    """Default Cache-Control for responses whose route did not set its own."""
+    if request.endpoint == "static":
+        response.headers["Cache-Control"] = STATIC_IMMUTABLE if "v" in request.args else STATIC_DEFAULT
+        response.headers.pop("Expires", None)
+    elif "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = NO_STORE
+        response.headers["Expires"] = 0
+        response.headers["Pragma"] = "no-cache"
+    return response
@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+import sqlalchemy as sa
+from flask import g
+from flask_login import UserMixin
+
+from .models import TransactionHistory, User
+from app import db, login
+
+# Per-request account figures that change with every trade or deposit
+AccountState = namedtuple("AccountState", ["cash", "latest_transaction_id"])
+
+
+class UserSnapshot(UserMixin):
+    """
+    The compact, read-only user Flask-Login keeps as current_user.
+
+    Holds only what never changes after registration. Views that change cash
+    or the password load the ORM User themselves.
+    """
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def __repr__(self):
+        return f'UserSnapshot(id={self.id}, username={self.username})'
+
+
+class IdentityCache:
+    """
+    In-process LRU of user snapshots, so an authenticated request costs no
+    query to identify its user. Usernames are immutable, so entries only go
+    stale when a user is deleted; call clear() after bulk changes such as
+    reset_db().
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.maxsize = app.config.get("IDENTITY_CACHE_SIZE", self.maxsize)
+        app.before_request(self._forget_account_state)
+        app.extensions["identity"] = self
+
+    @staticmethod
+    def _forget_account_state():
+        # g outlives a request when the caller pushed the app context (CLI
+        # commands, test clients), so drop account state left by an earlier one
+        g.pop("account_state", None)
+
+    def load(self, user_id):
+        """Snapshot of the user, or None if there is no such user."""
+        with self._lock:
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is not None:
+                self._snapshots.move_to_end(user_id)
+                return snapshot
+
+        row = db.session.execute(sa.select(User.id, User.username).where(User.id == user_id)).first()
+        if row is None:
+            return None
+        return self._store(UserSnapshot(row.id, row.username))
+
+    def remember(self, user):
+        """Snapshot an ORM User (e.g. just registered or logged in) and cache it."""
+        return self._store(UserSnapshot(user.id, user.username))
+
+    def _store(self, snapshot):
+        with self._lock:
+            self._snapshots[snapshot.id] = snapshot
+            self._snapshots.move_to_end(snapshot.id)
+            while len(self._snapshots) > self.maxsize:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+
+
+identity = IdentityCache()
+
+
+@login.user_loader
+def load_user(id):
+    return identity.load(int(id))
+
+
+def account_state(user_id):
+    """
+    The user's cash and latest transaction id, read with one query and kept
+    for the rest of the request.
+    """
+    state = g.get("account_state")
+    if state is None or state[0] != user_id:
+        latest = (
+            sa.select(sa.func.max(TransactionHistory.id))
+            .where(TransactionHistory.user_id == user_id)
+            .scalar_subquery()
+        )
+        row = db.session.execute(sa.select(User.cash, latest).where(User.id == user_id)).first()
+        state = g.account_state = (user_id, AccountState(*row) if row else AccountState(0.0, None))
+    return state[1]
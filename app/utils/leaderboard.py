@@ -0,0 +1,117 @@
+import threading
+import time
+
+import numpy as np
+import sqlalchemy as sa
+
+from .models import User
+from .valuation import value_all_accounts
+from app import db
+
+
+class LeaderboardSnapshot:
+    """Every account ranked by total value (cash plus holdings at market) at one moment."""
+
+    def __init__(self, accounts, computed_at):
+        order = np.argsort(-accounts["total"], kind="stable")
+        self.computed_at = computed_at
+        self.count = len(order)
+        self.user_ids = accounts["user_ids"][order]
+        self.total = accounts["total"][order]
+        self.holdings = accounts["holdings"][order]
+        self.pnl = accounts["pnl"][order]
+        self._ranks = {user_id: rank for rank, user_id in enumerate(self.user_ids.tolist(), start=1)}
+        self.top = []  # Display rows of the leading accounts, filled in by Leaderboard.compute()
+
+    def rank_of(self, user_id):
+        """1-based rank of the account, or None if it was created after the snapshot."""
+        return self._ranks.get(user_id)
+
+    def entry(self, user_id):
+        """The account's row as in top, or None."""
+        rank = self.rank_of(user_id)
+        if rank is None:
+            return None
+        i = rank - 1
+        return {"rank": rank, "user_id": user_id, "total": float(self.total[i]),
+                "holdings": float(self.holdings[i]), "pnl": float(self.pnl[i])}
+
+    def leaders(self, size, usernames):
+        """Display rows of the top size accounts, usernames mapping their ids to names."""
+        return [
+            {"rank": rank, "user_id": user_id, "username": usernames.get(user_id, "Unknown User"),
+             "total": total, "holdings": holdings, "pnl": pnl}
+            for rank, (user_id, total, holdings, pnl) in enumerate(zip(
+                self.user_ids[:size].tolist(), self.total[:size].tolist(),
+                self.holdings[:size].tolist(), self.pnl[:size].tolist()), start=1)
+        ]
+
+
+class Leaderboard:
+    """
+    Cached ranking of all accounts.
+
+    A snapshot values every account at once with value_all_accounts(): one
+    query, one batched quote lookup for the union of held symbols, then
+    vectorized math. Pages are always served from the latest snapshot. When it
+    is older than LEADERBOARD_REFRESH_INTERVAL seconds, one background thread
+    rebuilds it while requests keep getting the old one. Only the very first
+    request waits for a snapshot to be built.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.refresh_interval = 300
+        self.size = 100
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def init_app(self, app):
+        self.app = app
+        self.refresh_interval = app.config.get("LEADERBOARD_REFRESH_INTERVAL", self.refresh_interval)
+        self.size = app.config.get("LEADERBOARD_SIZE", self.size)
+        app.extensions["leaderboard"] = self
+
+    def compute(self):
+        """Build a new snapshot now; needs an app context."""
+        snapshot = LeaderboardSnapshot(value_all_accounts(), time.time())
+        top_ids = snapshot.user_ids[:self.size].tolist()
+        usernames = dict(db.session.execute(sa.select(User.id, User.username).where(User.id.in_(top_ids))).all())
+        snapshot.top = snapshot.leaders(self.size, usernames)
+        return snapshot
+
+    def refresh(self):
+        """Rebuild and publish the snapshot; needs an app context."""
+        snapshot = self.compute()
+        self._snapshot = snapshot
+        return snapshot
+
+    def snapshot(self):
+        """The latest snapshot, scheduling a background rebuild when it is stale."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self.refresh()
+                return self._snapshot
+
+        if time.time() - snapshot.computed_at >= self.refresh_interval:
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, name="leaderboard", daemon=True).start()
+        return snapshot
+
+    def _refresh_in_background(self):
+        try:
+            with self.app.app_context():
+                self.refresh()
+        except Exception as e:
+            self.app.logger.warning("Leaderboard refresh failed: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+leaderboard = Leaderboard()
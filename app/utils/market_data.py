@@ -0,0 +1,299 @@
+import csv
+import math
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+import numpy as np
+from blinker import Namespace
+
+from .rate_limit import rate_limiter
+
+# Columns of a daily OHLC history, as returned by MarketDataProvider.get_history()
+HISTORY_COLUMNS = ("time", "open", "high", "low", "close", "volume")
+
+
+def empty_history():
+    """A history with no bars."""
+    return {column: np.empty(0, dtype=np.int64 if column == "time" else np.float64)
+            for column in HISTORY_COLUMNS}
+
+
+_signals = Namespace()
+# Sent after every upstream quote fetch with duration (seconds) and the number of symbols
+quote_fetched = _signals.signal("quote-fetched")
+
+
+class QuoteError(Exception):
+    """Raised when a provider cannot price a symbol."""
+
+
+class MarketDataProvider:
+    """
+    Source of stock quotes.
+
+    Quotes are dicts of the form {"price": float, "symbol": str}, which is what
+    the views have always received from helpers.lookup().
+    """
+
+    def get_quotes(self, symbols):
+        """Return {symbol: quote} for the symbols that could be priced."""
+        raise NotImplementedError
+
+    def get_quote(self, symbol):
+        """Return the quote for one symbol, raising QuoteError if there is none."""
+        quote = self.get_quotes([symbol]).get(symbol)
+        if quote is None:
+            raise QuoteError(f"no quote for {symbol}")
+        return quote
+
+    def get_history(self, symbol, start=None):
+        """
+        Return daily bars for symbol from start (epoch seconds, None for all
+        available history) as a dict of arrays keyed by HISTORY_COLUMNS, with
+        "time" in epoch seconds and in ascending order.
+        """
+        raise NotImplementedError
+
+
+class YFinanceProvider(MarketDataProvider):
+    """
+    Live quotes from the Yahoo Finance API.
+
+    yfinance is imported on first use rather than with this module: it pulls
+    in pandas and costs about half of the app's cold start, which processes
+    that never fetch a quote (flask shell, CLI commands, the replay provider)
+    should not pay.
+    """
+
+    def get_quote(self, symbol):
+        import yfinance as yf
+        stock = yf.Ticker(symbol)
+        closes = stock.history(period="7d")["Close"]
+        if closes.empty:
+            raise QuoteError(f"no quote for {symbol}")
+
+        return {"price": round(float(closes.iloc[-1]), 2), "symbol": symbol}
+
+    def get_quotes(self, symbols):
+        import yfinance as yf
+        data = yf.download(symbols, period="7d", progress=False, group_by="column")
+        if data is None or data.empty:
+            return {}
+
+        closes = data["Close"]
+        # A single ticker may come back as a plain series rather than one column per ticker
+        if getattr(closes, "columns", None) is None:
+            closes = closes.to_frame(symbols[0])
+
+        quotes = {}
+        for symbol in symbols:
+            if symbol not in closes.columns:
+                continue
+            prices = closes[symbol].dropna()
+            if prices.empty:
+                continue
+            quotes[symbol] = {"price": round(float(prices.iloc[-1]), 2), "symbol": symbol}
+
+        return quotes
+
+    def get_history(self, symbol, start=None):
+        import yfinance as yf
+        stock = yf.Ticker(symbol)
+        if start is None:
+            bars = stock.history(period="max", interval="1d")
+        else:
+            bars = stock.history(start=datetime.fromtimestamp(start, timezone.utc).date(), interval="1d")
+        if bars is None or bars.empty:
+            return empty_history()
+
+        history = {"time": np.array([int(ts.timestamp()) for ts in bars.index], dtype=np.int64)}
+        for column in HISTORY_COLUMNS[1:]:
+            history[column] = bars[column.capitalize()].to_numpy(dtype=np.float64)
+        return history
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Offline quotes for load testing and benchmarks.
+
+    With a recorded file (CSV with "symbol" and "price" columns, rows in time
+    order) each request for a symbol returns its next recorded price, wrapping
+    around at the end; symbols that are not in the file are unknown. Without a
+    file every well-formed symbol follows its own seeded random walk.
+
+    latency_ms (plus up to jitter_ms) is slept on every upstream call and
+    error_rate is the probability that a call fails with QuoteError, so the
+    app's own throughput and tail latency can be measured without a network.
+    """
+
+    # Daily replay history starts here so that every run produces the same bars
+    HISTORY_ORIGIN = int(datetime(2000, 1, 3, tzinfo=timezone.utc).timestamp())
+
+    def __init__(self, path=None, seed=0, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                 volatility=0.01):
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.volatility = volatility
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recorded = self._load(path) if path else None
+        self._positions = {}  # symbol -> index into its recorded prices
+        self._walks = {}  # symbol -> (random.Random, last price)
+
+    @staticmethod
+    def _load(path):
+        recorded = {}
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                symbol = row["symbol"].strip().upper()
+                recorded.setdefault(symbol, []).append(float(row["price"]))
+        return recorded
+
+    def _simulate_upstream(self):
+        # Must be called without the lock held so that concurrent calls overlap
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+            failed = self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay / 1000)
+        if failed:
+            raise QuoteError("injected upstream failure")
+
+    def _is_known(self, symbol):
+        if self._recorded is not None:
+            return bool(self._recorded.get(symbol))
+        return 0 < len(symbol) <= 10 and symbol.replace(".", "").replace("-", "").isalnum()
+
+    def _next_price(self, symbol):
+        # Must be called with the lock held
+        if not self._is_known(symbol):
+            return None
+
+        if self._recorded is not None:
+            prices = self._recorded[symbol]
+            position = self._positions.get(symbol, 0)
+            self._positions[symbol] = (position + 1) % len(prices)
+            return prices[position]
+
+        walk = self._walks.get(symbol)
+        if walk is None:
+            rng = random.Random(self.seed ^ zlib.crc32(symbol.encode()))
+            walk = (rng, rng.uniform(20, 500))
+        rng, price = walk
+        price *= math.exp(rng.gauss(0, self.volatility))
+        self._walks[symbol] = (rng, price)
+        return price
+
+    def get_quotes(self, symbols):
+        self._simulate_upstream()
+
+        quotes = {}
+        with self._lock:
+            for symbol in symbols:
+                price = self._next_price(symbol)
+                if price is not None:
+                    quotes[symbol] = {"price": round(price, 2), "symbol": symbol}
+        return quotes
+
+    def get_history(self, symbol, start=None):
+        self._simulate_upstream()
+        if not self._is_known(symbol):
+            return empty_history()
+
+        # Seeded daily random walk from HISTORY_ORIGIN to today, sliced to start
+        days = (int(time.time()) - self.HISTORY_ORIGIN) // 86400 + 1
+        rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode())])
+        returns = rng.normal(0, self.volatility * 2, size=(days, 4))
+        close = 50 * np.exp(np.cumsum(returns[:, 0]))
+        open_ = close * np.exp(returns[:, 1] / 2)
+        high = np.maximum(open_, close) * np.exp(np.abs(returns[:, 2]) / 2)
+        low = np.minimum(open_, close) * np.exp(-np.abs(returns[:, 3]) / 2)
+        history = {
+            "time": self.HISTORY_ORIGIN + np.arange(days, dtype=np.int64) * 86400,
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": rng.integers(10_000, 10_000_000, size=days).astype(np.float64),
+        }
+
+        if start is not None:
+            first = np.searchsorted(history["time"], start)
+            history = {column: values[first:] for column, values in history.items()}
+        return history
+
+
+PROVIDERS = {
+    "yfinance": YFinanceProvider,
+    "replay": ReplayProvider,
+}
+
+
+def create_provider(config):
+    """Build the provider named by MARKET_DATA_PROVIDER."""
+    name = config.get("MARKET_DATA_PROVIDER", "yfinance")
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown MARKET_DATA_PROVIDER {name!r}, expected one of {sorted(PROVIDERS)}")
+
+    if name == "replay":
+        return ReplayProvider(
+            path=config.get("MARKET_DATA_REPLAY_FILE"),
+            seed=config.get("MARKET_DATA_SEED", 0),
+            latency_ms=config.get("MARKET_DATA_LATENCY_MS", 0.0),
+            jitter_ms=config.get("MARKET_DATA_LATENCY_JITTER_MS", 0.0),
+            error_rate=config.get("MARKET_DATA_ERROR_RATE", 0.0),
+        )
+    return PROVIDERS[name]()
+
+
+class MarketData:
+    """
+    Holds the provider selected in the app config.
+
+    Every call spends from the upstream budget first and raises
+    UpstreamBudgetExceeded, without calling the provider, once it is spent.
+    """
+
+    def __init__(self, provider=None):
+        self.provider = provider
+
+    def init_app(self, app):
+        self.provider = create_provider(app.config)
+        app.extensions["market_data"] = self
+
+    def _get_provider(self):
+        if self.provider is None:
+            self.provider = YFinanceProvider()
+        return self.provider
+
+    def get_quote(self, symbol):
+        rate_limiter.spend_upstream()
+        if not quote_fetched.receivers:
+            return self._get_provider().get_quote(symbol)
+        start = time.perf_counter()
+        try:
+            return self._get_provider().get_quote(symbol)
+        finally:
+            quote_fetched.send(self, duration=time.perf_counter() - start, symbols=1)
+
+    def get_quotes(self, symbols):
+        rate_limiter.spend_upstream()
+        if not quote_fetched.receivers:
+            return self._get_provider().get_quotes(symbols)
+        start = time.perf_counter()
+        try:
+            return self._get_provider().get_quotes(symbols)
+        finally:
+            quote_fetched.send(self, duration=time.perf_counter() - start, symbols=len(symbols))
+
+    def get_history(self, symbol, start=None):
+        rate_limiter.spend_upstream()
+        return self._get_provider().get_history(symbol, start)
+
+
+market_data = MarketData()
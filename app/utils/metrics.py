@@ -0,0 +1,222 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from flask import before_render_template, current_app, g, has_app_context, request, template_rendered
+
+from .database import sqlite_tuning
+from .helpers import quote_cache
+from .market_data import quote_fetched
+from .shared_quotes import shared_quotes
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Must be called with the registry's lock held
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """Prometheus text lines for this histogram."""
+        prefix = f"{labels}," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum:.6f}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class Metrics:
+    """
+    Per-request performance instrumentation, exported on /metrics.
+
+    Records per-route latency histograms and, per route, SQL statement count
+    and time (SQLAlchemy cursor events), upstream quote fetch time (the
+    quote_fetched signal) and template render time (Flask's template signals).
+    Requests slower than METRICS_SLOW_REQUEST_MS are logged with that
+    breakdown. Work a request hands to another thread (the order engine, the
+    quote deadline pool) counts towards it when that thread runs it inside
+    attributed(), with the targets the request's thread got from current().
+
+    Nothing is hooked up unless METRICS_ENABLED is set, so it costs nothing
+    when switched off.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_request_ms = None
+        self._lock = threading.Lock()
+        self._latency = {}  # (route, method) -> Histogram
+        self._totals = {}  # (route, name) -> float
+        self._upstream = Histogram()
+        self._attribution = threading.local()
+
+    def init_app(self, app, db):
+        self.enabled = app.config.get("METRICS_ENABLED", False)
+        if not self.enabled:
+            return
+        self.slow_request_ms = app.config.get("METRICS_SLOW_REQUEST_MS")
+        app.extensions["metrics"] = self
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+        with app.app_context():
+            engines = [db.engine]
+        if sqlite_tuning.writer is not None:
+            engines.append(sqlite_tuning.writer)
+        for engine in engines:
+            sa.event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            sa.event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        quote_fetched.connect(self._quote_fetched)
+
+        app.add_url_rule("/metrics", "metrics", self.export)
+
+    @staticmethod
+    def _start_request():
+        g.metrics = {"start": time.perf_counter(), "sql_count": 0, "sql_seconds": 0.0,
+                     "upstream_seconds": 0.0, "render_seconds": 0.0}
+
+    def current(self):
+        """
+        The metrics of the requests that work on this thread counts towards:
+        those set by attributed(), otherwise the current request's, if any.
+        """
+        if not self.enabled:
+            return []
+        targets = getattr(self._attribution, "targets", None)
+        if targets is not None:
+            return targets
+        current = g.get("metrics") if has_app_context() else None
+        return [current] if current is not None else []
+
+    @contextmanager
+    def attributed(self, targets):
+        """Count the SQL and upstream time of this thread towards targets, from current(), while open."""
+        previous = getattr(self._attribution, "targets", None)
+        self._attribution.targets = list(targets)
+        try:
+            yield
+        finally:
+            self._attribution.targets = previous
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+        for current in self.current():
+            current["sql_count"] += 1
+            current["sql_seconds"] += elapsed
+
+    @staticmethod
+    def _before_render(sender, template, context, **extra):
+        if "metrics" in g:
+            g.metrics["render_start"] = time.perf_counter()
+
+    @staticmethod
+    def _after_render(sender, template, context, **extra):
+        current = g.get("metrics")
+        if current is not None and "render_start" in current:
+            current["render_seconds"] += time.perf_counter() - current.pop("render_start")
+
+    def _quote_fetched(self, sender, duration, **extra):
+        with self._lock:
+            self._upstream.observe(duration)
+        for current in self.current():
+            current["upstream_seconds"] += duration
+
+    def _finish_request(self, response):
+        current = g.pop("metrics", None)
+        if current is None:
+            return response
+
+        elapsed = time.perf_counter() - current["start"]
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+
+        with self._lock:
+            histogram = self._latency.get((route, request.method))
+            if histogram is None:
+                histogram = self._latency[(route, request.method)] = Histogram()
+            histogram.observe(elapsed)
+            for name in ("sql_count", "sql_seconds", "upstream_seconds", "render_seconds"):
+                self._totals[(route, name)] = self._totals.get((route, name), 0) + current[name]
+
+        if self.slow_request_ms is not None and elapsed * 1000 >= self.slow_request_ms:
+            other = elapsed - current["sql_seconds"] - current["upstream_seconds"] - current["render_seconds"]
+            current_app.logger.warning(
+                "Slow request %s %s %.1fms: sql %d statements %.1fms, upstream %.1fms, render %.1fms, other %.1fms",
+                request.method, request.path, elapsed * 1000, current["sql_count"],
+                current["sql_seconds"] * 1000, current["upstream_seconds"] * 1000,
+                current["render_seconds"] * 1000, other * 1000,
+            )
+        return response
+
+    def export(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = ["# HELP finance_request_duration_seconds Request latency by route.",
+                 "# TYPE finance_request_duration_seconds histogram"]
+        with self._lock:
+            for (route, method), histogram in sorted(self._latency.items()):
+                lines += histogram.samples("finance_request_duration_seconds", _labels(route=route, method=method))
+
+            for name, kind, help_text in (
+                ("sql_count", "sql_statements_total", "SQL statements executed by route."),
+                ("sql_seconds", "sql_seconds_total", "Time spent in SQL by route."),
+                ("upstream_seconds", "upstream_seconds_total", "Time spent fetching quotes upstream by route."),
+                ("render_seconds", "render_seconds_total", "Time spent rendering templates by route."),
+            ):
+                lines += [f"# HELP finance_{kind} {help_text}", f"# TYPE finance_{kind} counter"]
+                for (route, total_name), value in sorted(self._totals.items()):
+                    if total_name == name:
+                        lines.append(f"finance_{kind}{{{_labels(route=route)}}} {value:g}")
+
+            lines += ["# HELP finance_upstream_fetch_seconds Upstream quote fetch latency.",
+                      "# TYPE finance_upstream_fetch_seconds histogram"]
+            lines += self._upstream.samples("finance_upstream_fetch_seconds", "")
+
+        stats = quote_cache.stats()
+        for name in ("hits", "misses", "evictions", "coalesced"):
+            lines += [f"# TYPE finance_quote_cache_{name}_total counter",
+                      f"finance_quote_cache_{name}_total {stats[name]}"]
+        lines += ["# TYPE finance_quote_cache_size gauge", f"finance_quote_cache_size {stats['size']}"]
+        if shared_quotes.enabled:
+            stats = shared_quotes.stats()
+            lines += ["# TYPE finance_shared_quotes_used gauge", f"finance_shared_quotes_used {stats['used']}",
+                      "# TYPE finance_shared_quotes_writer gauge",
+                      f"finance_shared_quotes_writer {int(stats['writer'])}"]
+
+        return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+metrics = Metrics()
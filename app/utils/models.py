@@ -3,7 +3,7 @@ import sqlalchemy as sa
 import sqlalchemy.orm as so
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from app import db, login
+from app import db
 
 
 class User(UserMixin, db.Model):
@@ -30,6 +30,10 @@ class User(UserMixin, db.Model):
 
 class TransactionHistory(db.Model):
     __tablename__ = 'transaction_history'
+    __table_args__ = (
+        # Serves the keyset-paginated history page: WHERE user_id = ? ORDER BY transaction_time, id
+        sa.Index('ix_transaction_history_user_time_id', 'user_id', 'transaction_time', 'id'),
+    )
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'))
@@ -47,7 +51,11 @@ class TransactionHistory(db.Model):
 
 
 class StockPortfolio(db.Model):
+    """One open position per (user, symbol), maintained by utils/positions.py."""
     __tablename__ = 'stock_portfolio'
+    __table_args__ = (
+        sa.Index('ix_stock_portfolio_user_stock', 'user_id', 'stock_id', unique=True),
+    )
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'))
@@ -59,9 +67,118 @@ class StockPortfolio(db.Model):
     user: so.Mapped['User'] = so.relationship(back_populates='portfolio')
 
     def __repr__(self):
-        return f'StockPortfolio(id={self.id}, user_id={self.user_id}, stock_id={self.stock_id}, quantity={self.quantity}, purchase_price={self.purchase_price})'
+        return f'StockPortfolio(id={self.id}, user_id={self.user_id}, stock_id={self.stock_id}, quantity={self.quantity}, buy_price={self.buy_price})'
 
 
-@login.user_loader
-def load_user(id):
-    return db.session.get(User, int(id))
\ No newline at end of file
+class TaxLot(db.Model):
+    """Shares bought by one purchase; sales consume open lots FIFO (utils/tax_lots.py)."""
+    __tablename__ = 'tax_lots'
+    __table_args__ = (
+        # The FIFO queue of a position: only lots with shares left, oldest first
+        sa.Index('ix_tax_lots_open', 'user_id', 'stock_id', 'opened_at', 'id',
+                 sqlite_where=sa.text('remaining > 0')),
+    )
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'))
+    stock_id: so.Mapped[str] = so.mapped_column(sa.String(10), nullable=False)
+    transaction_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey('transaction_history.id'))
+    quantity: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)  # Shares bought
+    remaining: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)  # Shares not yet sold
+    price: so.Mapped[float] = so.mapped_column(sa.Float, nullable=False)
+    opened_at: so.Mapped[sa.DateTime] = so.mapped_column(sa.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'TaxLot(id={self.id}, user_id={self.user_id}, stock_id={self.stock_id}, quantity={self.quantity}, remaining={self.remaining}, price={self.price})'
+
+
+class RealizedGain(db.Model):
+    """The shares of one lot consumed by one sale, and the gain on them."""
+    __tablename__ = 'realized_gains'
+    __table_args__ = (
+        sa.Index('ix_realized_gains_user_time', 'user_id', 'realized_at'),
+    )
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'))
+    stock_id: so.Mapped[str] = so.mapped_column(sa.String(10), nullable=False)
+    sale_transaction_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey('transaction_history.id'))
+    lot_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey('tax_lots.id'))  # None if sold from a position without lots
+    quantity: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    cost_price: so.Mapped[float] = so.mapped_column(sa.Float, nullable=False)
+    sale_price: so.Mapped[float] = so.mapped_column(sa.Float, nullable=False)
+    gain: so.Mapped[float] = so.mapped_column(sa.Float, nullable=False)
+    realized_at: so.Mapped[sa.DateTime] = so.mapped_column(sa.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'RealizedGain(id={self.id}, user_id={self.user_id}, stock_id={self.stock_id}, quantity={self.quantity}, gain={self.gain})'
+
+
+class RealizedGainSummary(db.Model):
+    """Running realized totals per (user, symbol, month), kept up to date by every sale."""
+    __tablename__ = 'realized_gain_summary'
+    __table_args__ = (
+        sa.Index('ix_realized_gain_summary_key', 'user_id', 'stock_id', 'period', unique=True),
+    )
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'))
+    stock_id: so.Mapped[str] = so.mapped_column(sa.String(10), nullable=False)
+    period: so.Mapped[str] = so.mapped_column(sa.String(7), nullable=False)  # 'YYYY-MM'
+    quantity: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    proceeds: so.Mapped[float] = so.mapped_column(sa.Float, nullable=False)
+    cost: so.Mapped[float] = so.mapped_column(sa.Float, nullable=False)
+    gain: so.Mapped[float] = so.mapped_column(sa.Float, nullable=False)
+
+    def __repr__(self):
+        return f'RealizedGainSummary(user_id={self.user_id}, stock_id={self.stock_id}, period={self.period}, gain={self.gain})'
+
+
+class AccountEntry(db.Model):
+    """One change to an account's cash or holdings; rows are only ever appended (utils/account_ledger.py)."""
+    __tablename__ = 'account_entries'
+    __table_args__ = (
+        # Entries of an account after its snapshot: WHERE user_id = ? AND id > ?
+        sa.Index('ix_account_entries_user_id', 'user_id', 'id'),
+    )
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'))
+    kind: so.Mapped[str] = so.mapped_column(sa.String(8), nullable=False)  # 'opening', 'deposit', 'buy' or 'sell'
+    stock_id: so.Mapped[Optional[str]] = so.mapped_column(sa.String(10))  # Trades only
+    cash_delta: so.Mapped[float] = so.mapped_column(sa.Float, nullable=False)
+    quantity_delta: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False, default=0)
+    transaction_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey('transaction_history.id'))
+    created_at: so.Mapped[sa.DateTime] = so.mapped_column(sa.DateTime, default=sa.func.now())
+
+    def __repr__(self):
+        return f'AccountEntry(id={self.id}, user_id={self.user_id}, kind={self.kind}, stock_id={self.stock_id}, cash_delta={self.cash_delta}, quantity_delta={self.quantity_delta})'
+
+
+class AccountSnapshot(db.Model):
+    """An account's cash after every entry up to entry_id, taken by a clean reconciliation."""
+    __tablename__ = 'account_snapshots'
+
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'), primary_key=True)
+    entry_id: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    cash: so.Mapped[float] = so.mapped_column(sa.Float, nullable=False)
+    taken_at: so.Mapped[sa.DateTime] = so.mapped_column(sa.DateTime, default=sa.func.now())
+
+    def __repr__(self):
+        return f'AccountSnapshot(user_id={self.user_id}, entry_id={self.entry_id}, cash={self.cash})'
+
+
+class AccountSnapshotPosition(db.Model):
+    """A holding of an account as of its AccountSnapshot."""
+    __tablename__ = 'account_snapshot_positions'
+    __table_args__ = (
+        sa.Index('ix_account_snapshot_positions_user_stock', 'user_id', 'stock_id', unique=True),
+    )
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'))
+    stock_id: so.Mapped[str] = so.mapped_column(sa.String(10), nullable=False)
+    quantity: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'AccountSnapshotPosition(user_id={self.user_id}, stock_id={self.stock_id}, quantity={self.quantity})'
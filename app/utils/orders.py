@@ -0,0 +1,280 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import sqlalchemy as sa
+
+from .account_ledger import record_entry
+from .metrics import metrics
+from .models import TransactionHistory, User
+from .positions import apply_buy, apply_sell
+from .quote_deadlines import QuoteDeadlineExceeded, quote_deadlines
+from .rate_limit import UpstreamBudgetExceeded
+from .tax_lots import consume_lots, open_lot
+from app import db
+
+# transaction_type recorded for each order side
+TRANSACTION_TYPES = {"buy": "buy", "sell": "Sale"}
+
+
+class OrderRejected(Exception):
+    """An order that could not be executed; reason is a short machine-readable code."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+
+class Order:
+    """A buy or sell order waiting in the engine's queue."""
+
+    def __init__(self, user_id, side, symbol, quantity, metrics=()):
+        if side not in TRANSACTION_TYPES:
+            raise ValueError(f"Unknown order side {side!r}")
+        self.user_id = user_id
+        self.side = side
+        self.symbol = symbol.upper()
+        self.quantity = quantity
+        self.metrics = metrics  # Of the request that placed it, see Metrics.current()
+        self.future = Future()
+
+
+class OrderResult:
+    """What an executed order changed."""
+
+    def __init__(self, order, price, cash, position_quantity, position_price, realized_gain=None):
+        self.user_id = order.user_id
+        self.side = order.side
+        self.symbol = order.symbol
+        self.quantity = order.quantity
+        self.price = price
+        self.total = price * order.quantity
+        self.cash = cash  # New cash balance
+        # New quantity and cost basis of the position, quantity 0 once closed
+        self.position_quantity = position_quantity
+        self.position_price = position_price
+        self.realized_gain = realized_gain  # Sales only: gain on the lots consumed
+
+    def as_dict(self):
+        """The trade and the account state it left, as returned by the JSON trade endpoints."""
+        return {
+            "side": self.side,
+            "symbol": self.symbol,
+            "quantity": self.quantity,
+            "price": self.price,
+            "total": self.total,
+            "cash": self.cash,
+            "position": {
+                "symbol": self.symbol,
+                "quantity": self.position_quantity,
+                "average_price": self.position_price if self.position_quantity else None,
+            },
+            "realized_gain": self.realized_gain,
+        }
+
+
+class OrderEngine:
+    """
+    Executes trades from a queue on a single worker thread.
+
+    Orders arriving within ORDER_BATCH_WINDOW_MS of each other (up to
+    ORDER_MAX_BATCH) form a batch. Every symbol in the batch is priced with one
+    lookup_many() call, so concurrent orders for the same symbol share a fetch.
+    Cash and position changes are conditional UPDATEs (cash >= cost, quantity
+    >= shares sold), so an order can never overdraw an account however many
+    are submitted at once, and the whole batch is committed together.
+
+    Pricing is bounded by QUOTE_DEADLINE like the views' own lookups: a batch
+    whose quotes miss it has its orders rejected ("timeout"), so one hung
+    upstream call cannot hold up the batches queued behind it.
+
+    If a batch fails unexpectedly it is rolled back and its orders are retried
+    one transaction each, so one bad order cannot fail its neighbours.
+
+    An order still queued when its view stops waiting is cancelled and never
+    executes; one the engine has already picked up completes regardless.
+
+    With metrics enabled, each order's own statements count towards the
+    request that placed it, and the batch's shared pricing and commit towards
+    every request in the batch, since each of them waited for it.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.batch_window = 0.005
+        self.max_batch = 100
+        self.timeout = 30
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_window = app.config.get("ORDER_BATCH_WINDOW_MS", 5) / 1000
+        self.max_batch = app.config.get("ORDER_MAX_BATCH", self.max_batch)
+        self.timeout = app.config.get("ORDER_TIMEOUT", self.timeout)
+        app.extensions["order_engine"] = self
+
+    def submit(self, user_id, side, symbol, quantity):
+        """Queue an order; the returned Future resolves to an OrderResult or raises OrderRejected."""
+        order = Order(user_id, side, symbol, quantity, metrics.current())
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="order-engine", daemon=True)
+                self._thread.start()
+        self._queue.put(order)
+        return order.future
+
+    def execute(self, user_id, side, symbol, quantity):
+        """
+        Submit an order and wait up to ORDER_TIMEOUT seconds for it to be executed.
+
+        If the order has not started by then it is cancelled and OrderRejected
+        ("timeout") is raised. If it is already executing, TimeoutError is
+        raised and the order still goes through.
+        """
+        future = self.submit(user_id, side, symbol, quantity)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise OrderRejected("timeout", "The market is busy, your order was cancelled. Please try again.") \
+                    from None
+            raise
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Orders cancelled while queued are dropped; the rest can no longer be cancelled
+            batch = [order for order in self._next_batch() if order.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            with self.app.app_context():
+                try:
+                    self.execute_batch(batch)
+                except Exception as e:
+                    # Running out of upstream budget is expected under load and reported to each view
+                    if not isinstance(e, UpstreamBudgetExceeded):
+                        self.app.logger.exception("Order batch failed: %s", e)
+                    for order in batch:
+                        if not order.future.done():
+                            order.future.set_exception(e)
+
+    def execute_batch(self, batch):
+        """Price, apply and commit a batch of orders; needs an app context."""
+        everyone = [target for order in batch for target in order.metrics]
+        with metrics.attributed(everyone):
+            try:
+                quotes = quote_deadlines.lookup_many({order.symbol for order in batch})
+            except QuoteDeadlineExceeded:
+                for order in batch:
+                    order.future.set_exception(OrderRejected(
+                        "timeout", "Prices are not available right now, your order was not executed. Please try again."))
+                return
+
+        outcomes = []
+        try:
+            for order in batch:
+                with metrics.attributed(order.metrics):
+                    outcomes.append(self._apply(order, quotes.get(order.symbol)))
+            with metrics.attributed(everyone):
+                db.session.commit()
+        except Exception:
+            with metrics.attributed(everyone):
+                db.session.rollback()
+            outcomes = self._apply_one_by_one(batch, quotes)
+
+        for order, outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
+                order.future.set_exception(outcome)
+            else:
+                order.future.set_result(outcome)
+
+    def _apply_one_by_one(self, batch, quotes):
+        outcomes = []
+        for order in batch:
+            with metrics.attributed(order.metrics):
+                try:
+                    outcome = self._apply(order, quotes.get(order.symbol))
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    outcome = e
+            outcomes.append(outcome)
+        return outcomes
+
+    def _apply(self, order, quote):
+        """
+        Apply one order in the current transaction.
+
+        Returns the OrderResult, or an OrderRejected (returned, not raised) when
+        a precondition fails; in that case nothing has been written.
+        """
+        if quote is None:
+            return OrderRejected("unknown_symbol", "Please enter a valid symbol")
+
+        users = User.__table__
+        history = TransactionHistory.__table__
+        price = quote["price"]
+        total = price * order.quantity
+
+        if order.side == "buy":
+            cash = db.session.execute(
+                sa.update(users)
+                .where(users.c.id == order.user_id, users.c.cash >= total)
+                .values(cash=users.c.cash - total)
+                .returning(users.c.cash)
+            ).scalar_one_or_none()
+            if cash is None:
+                return OrderRejected("insufficient_cash", "Not enough cash in account!")
+            position = apply_buy(order.user_id, order.symbol, order.quantity, price)
+        else:
+            position = apply_sell(order.user_id, order.symbol, order.quantity)
+            if position is None:
+                return OrderRejected("insufficient_shares", "not enough shares to sell")
+            cash = db.session.execute(
+                sa.update(users)
+                .where(users.c.id == order.user_id)
+                .values(cash=users.c.cash + total)
+                .returning(users.c.cash)
+            ).scalar_one()
+
+        transaction = db.session.execute(
+            sa.insert(history).values(
+                user_id=order.user_id,
+                stock_id=order.symbol,
+                transaction_type=TRANSACTION_TYPES[order.side],
+                quantity=order.quantity,
+                price=price,
+            ).returning(history.c.id, history.c.transaction_time)
+        ).one()
+
+        signed = order.quantity if order.side == "buy" else -order.quantity
+        record_entry(order.user_id, order.side, -signed * price, order.symbol, signed, transaction.id,
+                     transaction.transaction_time)
+
+        if order.side == "buy":
+            open_lot(order.user_id, order.symbol, order.quantity, price, transaction.id, transaction.transaction_time)
+            return OrderResult(order, price, cash, position.quantity, position.buy_price)
+
+        # Selling the oldest lots first moves the cost basis of the shares left
+        gain, basis = consume_lots(order.user_id, order.symbol, order.quantity, price, transaction.id,
+                                   transaction.transaction_time, fallback_cost=position.buy_price)
+        return OrderResult(order, price, cash, position.quantity, position.buy_price if basis is None else basis,
+                           realized_gain=gain)
+
+order_engine = OrderEngine()
@@ -0,0 +1,175 @@
+from collections import deque
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .database import bulk_insert
+from .models import RealizedGain, RealizedGainSummary, StockPortfolio, TaxLot, TransactionHistory
+from app import db
+
+# transaction_type values written for sales over time
+SELL_TYPES = ("sell", "Sale")
+
+
+def apply_buy(user_id, symbol, quantity, price):
+    """
+    Add quantity shares bought at price to the user's position in symbol.
+
+    A single upsert on the (user_id, stock_id) unique index, so the quantity
+    and weighted cost basis are updated atomically in the caller's transaction.
+    Returns the position's new (quantity, buy_price).
+    """
+    portfolio = StockPortfolio.__table__
+    stmt = sqlite_insert(portfolio).values(
+        user_id=user_id, stock_id=symbol, quantity=quantity, buy_price=price
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[portfolio.c.user_id, portfolio.c.stock_id],
+        set_={
+            "quantity": portfolio.c.quantity + stmt.excluded.quantity,
+            "buy_price": (
+                portfolio.c.quantity * portfolio.c.buy_price + stmt.excluded.quantity * stmt.excluded.buy_price
+            ) / (portfolio.c.quantity + stmt.excluded.quantity),
+        },
+    )
+    return db.session.execute(stmt.returning(portfolio.c.quantity, portfolio.c.buy_price)).one()
+
+
+def apply_sell(user_id, symbol, quantity):
+    """
+    Remove quantity shares from the user's position in symbol.
+
+    Returns the position's new (quantity, buy_price), or None, changing
+    nothing, if fewer than quantity shares are held. The cost basis per share
+    of the remaining shares is unchanged.
+    """
+    portfolio = StockPortfolio.__table__
+    position = sa.and_(portfolio.c.user_id == user_id, portfolio.c.stock_id == symbol)
+
+    remaining = db.session.execute(
+        sa.update(portfolio)
+        .where(position, portfolio.c.quantity >= quantity)
+        .values(quantity=portfolio.c.quantity - quantity)
+        .returning(portfolio.c.quantity, portfolio.c.buy_price)
+    ).one_or_none()
+    if remaining is None:
+        return None
+
+    # Close the position once every share has been sold
+    if remaining.quantity <= 0:
+        db.session.execute(sa.delete(portfolio).where(position))
+    return remaining
+
+
+def replay_trades(trades):
+    """
+    Replay trades FIFO into the tax-lot ledger and the positions it implies.
+
+    trades are (transaction_id, user_id, symbol, transaction_type, quantity,
+    price, transaction_time) in time order, with transaction_time as SQLite
+    datetime text. Every buy opens a lot and every sale consumes the oldest
+    open lots of its position; shares sold beyond what was bought are
+    ignored. Returns rows, as tuples in table column order, for tax_lots
+    (ids numbered from 1), realized_gains, realized_gain_summary and
+    stock_portfolio.
+    """
+    lots = []  # [id, user_id, symbol, transaction_id, quantity, remaining, price, opened_at]
+    gains = []
+    summary = {}  # (user_id, symbol, period) -> [quantity, proceeds, cost, gain]
+    open_lots = {}  # (user_id, symbol) -> deque of the position's open lots, oldest first
+    add_lot, add_gain = lots.append, gains.append
+
+    for transaction_id, user_id, symbol, transaction_type, quantity, price, transaction_time in trades:
+        symbol = symbol.upper()
+        queue = open_lots.get((user_id, symbol))
+        if transaction_type not in SELL_TYPES:
+            lot = [len(lots) + 1, user_id, symbol, transaction_id, quantity, quantity, price, transaction_time]
+            add_lot(lot)
+            if queue is None:
+                queue = open_lots[(user_id, symbol)] = deque()
+            queue.append(lot)
+            continue
+
+        sold = 0
+        cost = 0.0
+        while queue and sold < quantity:
+            lot = queue[0]
+            used = min(lot[5], quantity - sold)
+            lot[5] -= used
+            if not lot[5]:
+                queue.popleft()
+            sold += used
+            cost += used * lot[6]
+            add_gain((user_id, symbol, transaction_id, lot[0], used, lot[6], price, used * (price - lot[6]),
+                      transaction_time))
+        if sold:
+            # transaction_time is SQLite datetime text, so its first 7 characters are the 'YYYY-MM' period
+            totals = summary.get((user_id, symbol, transaction_time[:7]))
+            if totals is None:
+                totals = summary[(user_id, symbol, transaction_time[:7])] = [0, 0.0, 0.0, 0.0]
+            totals[0] += sold
+            totals[1] += sold * price
+            totals[2] += cost
+            totals[3] += sold * price - cost
+
+    positions = []
+    for (user_id, symbol), queue in open_lots.items():
+        quantity = sum(lot[5] for lot in queue)
+        if quantity > 0:
+            positions.append((user_id, symbol, quantity, sum(lot[5] * lot[6] for lot in queue) / quantity))
+
+    return ([tuple(lot) for lot in lots], gains,
+            [(*key, *totals) for key, totals in summary.items()], positions)
+
+
+def replay_history():
+    """replay_trades() over all of transaction_history, in time order."""
+    history = TransactionHistory.__table__
+    rows = db.session.execute(
+        sa.select(history.c.id, history.c.user_id, history.c.stock_id, history.c.transaction_type,
+                  history.c.quantity, history.c.price, sa.type_coerce(history.c.transaction_time, sa.String))
+        .order_by(history.c.transaction_time, history.c.id)
+        .execution_options(yield_per=10000)
+    )
+    return replay_trades(rows)
+
+
+def rebuild_positions():
+    """
+    Recompute stock_portfolio and the tax-lot ledger from transaction_history.
+
+    Replays every transaction in time order (see replay_trades), then replaces
+    the contents of stock_portfolio, tax_lots, realized_gains and
+    realized_gain_summary in one transaction. Returns the number of open
+    positions written.
+    """
+    lots, gains, summary, positions = replay_history()
+
+    tables = [StockPortfolio.__table__, TaxLot.__table__, RealizedGain.__table__, RealizedGainSummary.__table__]
+    # Databases created before the ledger existed need its tables, and the unique index apply_buy's upsert uses
+    connection = db.session.connection(bind_arguments={"clause": sa.delete(StockPortfolio.__table__)})
+    db.metadata.create_all(connection, tables=tables)
+    for table in reversed(tables):
+        db.session.execute(sa.delete(table))
+    # Only once the old rows are gone, as they may hold duplicate positions
+    for index in StockPortfolio.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+    write_ledger(lots, gains, summary, positions)
+    db.session.commit()
+
+    return len(positions)
+
+
+def write_ledger(lots, gains, summary, positions, chunk_size=50000):
+    """Bulk insert the rows returned by replay_trades()."""
+    bulk_insert(db.session, TaxLot.__table__,
+                ("id", "user_id", "stock_id", "transaction_id", "quantity", "remaining", "price", "opened_at"),
+                lots, chunk_size)
+    bulk_insert(db.session, RealizedGain.__table__,
+                ("user_id", "stock_id", "sale_transaction_id", "lot_id", "quantity", "cost_price", "sale_price",
+                 "gain", "realized_at"), gains, chunk_size)
+    bulk_insert(db.session, RealizedGainSummary.__table__,
+                ("user_id", "stock_id", "period", "quantity", "proceeds", "cost", "gain"), summary, chunk_size)
+    bulk_insert(db.session, StockPortfolio.__table__, ("user_id", "stock_id", "quantity", "buy_price"),
+                positions, chunk_size)
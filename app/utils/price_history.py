@@ -0,0 +1,189 @@
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from .market_data import HISTORY_COLUMNS, empty_history, market_data
+from .rate_limit import UpstreamBudgetExceeded
+
+# On-disk dtype of each history column
+COLUMN_DTYPES = {column: np.dtype("<i8") if column == "time" else np.dtype("<f8") for column in HISTORY_COLUMNS}
+
+# Symbols double as directory names, so only plain ticker characters are allowed, with at least one
+# letter or digit and no leading dot (which rules out "." and "..")
+SYMBOL_PATTERN = re.compile(r"(?=.*[A-Z0-9])[A-Z0-9^][A-Z0-9.^=-]{0,9}")
+
+
+class HistoryUnavailable(Exception):
+    """Raised when the provider fails and nothing is stored for the symbol yet."""
+
+
+class PriceHistoryStore:
+    """
+    Local store of daily OHLC bars, one directory per symbol.
+
+    Each column is an append-only file of raw little-endian values
+    (<folder>/<SYMBOL>/<column>.bin) read back through np.memmap, so a chart
+    only touches the pages for the range it shows. update() only asks the
+    provider for bars from the last one stored onwards, and at most once every
+    HISTORY_REFRESH_INTERVAL seconds per symbol. The last stored bar is
+    rewritten on every update, since it may be today's bar stored mid-session.
+
+    If a write is interrupted the columns can end up with different lengths;
+    readers only use the rows present in every column and the next append
+    trims the extra values.
+    """
+
+    def __init__(self, folder=None, refresh_interval=3600):
+        self.folder = folder
+        self.refresh_interval = refresh_interval
+        self._locks = {}  # symbol -> threading.Lock serialising its updates
+        self._locks_lock = threading.Lock()
+        self._checked = {}  # symbol -> monotonic time of the last upstream check
+
+    def init_app(self, app):
+        self.folder = app.config["HISTORY_FOLDER"]
+        self.refresh_interval = app.config.get("HISTORY_REFRESH_INTERVAL", self.refresh_interval)
+        app.extensions["price_history"] = self
+
+    def _path(self, symbol, column):
+        if not SYMBOL_PATTERN.fullmatch(symbol):
+            raise ValueError(f"Invalid symbol {symbol!r}")
+        return os.path.join(self.folder, symbol, f"{column}.bin")
+
+    def _lock(self, symbol):
+        with self._locks_lock:
+            return self._locks.setdefault(symbol, threading.Lock())
+
+    def _length(self, symbol):
+        """Number of complete rows stored for symbol."""
+        sizes = []
+        for column, dtype in COLUMN_DTYPES.items():
+            path = self._path(symbol, column)
+            sizes.append(os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0)
+        return min(sizes)
+
+    def read(self, symbol, start=None):
+        """Return the stored bars for symbol from start (epoch seconds) onwards, memory-mapped."""
+        length = self._length(symbol)
+        if length == 0:
+            return empty_history()
+
+        history = {
+            column: np.memmap(self._path(symbol, column), dtype=dtype, mode="r", shape=(length,))
+            for column, dtype in COLUMN_DTYPES.items()
+        }
+        if start is not None:
+            first = np.searchsorted(history["time"], start)
+            history = {column: values[first:] for column, values in history.items()}
+        return history
+
+    def append(self, symbol, bars):
+        """
+        Append bars newer than the last stored one, replacing the last stored
+        one if bars include it; returns how many were written.
+        """
+        with self._lock(symbol):
+            return self._append(symbol, bars)
+
+    def _append(self, symbol, bars):
+        # Must be called with the symbol's lock held
+        os.makedirs(os.path.dirname(self._path(symbol, "time")), exist_ok=True)
+        length = self._length(symbol)
+
+        times = np.asarray(bars["time"], dtype=np.int64)
+        first = 0
+        if length:
+            last = np.memmap(self._path(symbol, "time"), dtype=COLUMN_DTYPES["time"], mode="r", shape=(length,))[-1]
+            first = int(np.searchsorted(times, last))
+            if first < len(times) and times[first] == last:
+                # The stored last bar may have been a partial day: overwrite it
+                length -= 1
+        new = len(times) - first
+        if new == 0:
+            return 0
+
+        for column, dtype in COLUMN_DTYPES.items():
+            with open(self._path(symbol, column), "ab") as f:
+                # Drop values left behind by an interrupted append before adding ours
+                f.truncate(length * dtype.itemsize)
+                f.write(np.ascontiguousarray(bars[column][first:], dtype=dtype).tobytes())
+        return new
+
+    def update(self, symbol):
+        """Fetch and store any bars missing from the tail of symbol's history."""
+        with self._lock(symbol):
+            checked = self._checked.get(symbol)
+            if checked is not None and time.monotonic() - checked < self.refresh_interval:
+                return 0
+
+            length = self._length(symbol)
+            start = None
+            if length:
+                # From the last stored bar itself, so it is replaced by its final version
+                start = int(np.memmap(self._path(symbol, "time"), dtype=COLUMN_DTYPES["time"], mode="r",
+                                      shape=(length,))[-1])
+
+            bars = market_data.get_history(symbol, start)
+            self._checked[symbol] = time.monotonic()
+            if len(bars["time"]) == 0:
+                return 0
+            return self._append(symbol, bars)
+
+    def history(self, symbol, start=None):
+        """
+        Bring symbol's history up to date, then read it from start onwards.
+
+        If the update fails, whatever is stored already is served. With nothing
+        stored, UpstreamBudgetExceeded propagates and any provider or network
+        error is raised as HistoryUnavailable.
+        """
+        try:
+            self.update(symbol)
+        except UpstreamBudgetExceeded:
+            if not self._length(symbol):
+                raise
+        except Exception as e:
+            if not self._length(symbol):
+                raise HistoryUnavailable(f"no price history for {symbol}: {e}") from e
+        return self.read(symbol, start)
+
+
+def lttb(x, y, threshold):
+    """
+    Downsample the series (x, y) to threshold points with Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last points and, from each bucket in between, the point
+    forming the largest triangle with the previously kept point and the average
+    of the next bucket, which preserves the visual shape of the line.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.asarray(x), np.asarray(y)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[end:next_end].mean() if next_end > end else x[-1]
+        next_y = y[end:next_end].mean() if next_end > end else y[-1]
+
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+
+    return x[selected], y[selected]
+
+
+price_history = PriceHistoryStore()
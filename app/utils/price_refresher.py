@@ -0,0 +1,130 @@
+import threading
+import time
+
+import sqlalchemy as sa
+
+from .helpers import quote_cache
+from .market_data import market_data
+from .models import StockPortfolio
+from .rate_limit import UpstreamBudgetExceeded
+from .shared_quotes import shared_quotes
+from app import db
+
+
+class PriceRefresher:
+    """
+    Background thread that keeps quotes for held symbols warm in the quote cache.
+
+    The symbols worth refreshing are the distinct stock_id values in
+    stock_portfolio; the set is re-read on every pass, so positions that open
+    or close are picked up without any extra bookkeeping. The most widely held
+    symbols are refreshed every PRICE_REFRESH_HOT_INTERVAL seconds and the rest
+    every PRICE_REFRESH_INTERVAL seconds, in batches of PRICE_REFRESH_BATCH_SIZE.
+    As long as both intervals are shorter than QUOTE_CACHE_TTL, page loads that
+    price held symbols are served from the cache and never wait on upstream.
+
+    With SHARED_QUOTES_ENABLED the refresher always runs, whatever
+    PRICE_REFRESHER_ENABLED says, since it is what fills the shared table for
+    every worker. Only the process that writes the table refreshes; the
+    refreshers of the other worker processes stand down and take over if it
+    exits.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 30
+        self.hot_interval = 10
+        self.hot_count = 20
+        self.batch_size = 50
+        self._next_due = {}  # symbol -> monotonic time of its next refresh
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get("PRICE_REFRESH_INTERVAL", self.interval)
+        self.hot_interval = app.config.get("PRICE_REFRESH_HOT_INTERVAL", self.hot_interval)
+        self.hot_count = app.config.get("PRICE_REFRESH_HOT_COUNT", self.hot_count)
+        self.batch_size = app.config.get("PRICE_REFRESH_BATCH_SIZE", self.batch_size)
+        app.extensions["price_refresher"] = self
+
+        if app.config.get("PRICE_REFRESHER_ENABLED") or app.config.get("SHARED_QUOTES_ENABLED"):
+            self.start()
+
+    def held_symbols(self):
+        """Return {symbol: number of holders}, most widely held first."""
+        rows = db.session.execute(
+            sa.select(
+                sa.func.upper(StockPortfolio.stock_id),
+                sa.func.count(sa.distinct(StockPortfolio.user_id)).label("holders"),
+            )
+            .group_by(sa.func.upper(StockPortfolio.stock_id))
+            .order_by(sa.desc("holders"))
+        ).all()
+        return {symbol: holders for symbol, holders in rows}
+
+    def refresh_due(self):
+        """Re-price every held symbol whose refresh is due; returns how many were refreshed."""
+        if shared_quotes.enabled and not shared_quotes.claim_writer():
+            return 0
+
+        held = self.held_symbols()
+        hot = set(list(held)[:self.hot_count])
+
+        # Forget symbols nobody holds any more
+        for symbol in list(self._next_due):
+            if symbol not in held:
+                del self._next_due[symbol]
+
+        now = time.monotonic()
+        due = [symbol for symbol in held if self._next_due.get(symbol, 0) <= now]
+
+        refreshed = 0
+        for start in range(0, len(due), self.batch_size):
+            batch = due[start:start + self.batch_size]
+            try:
+                quotes = market_data.get_quotes(batch)
+            except UpstreamBudgetExceeded:
+                # Requests get the budget first; what is left due is retried on a later pass
+                break
+            except Exception as e:
+                # Leave the batch due so the next pass retries it
+                self.app.logger.warning("Price refresh failed for %s: %s", batch, e)
+                continue
+
+            for symbol, quote in quotes.items():
+                quote_cache.put(symbol, quote)
+            shared_quotes.publish(quotes)
+            refreshed += len(quotes)
+
+            now = time.monotonic()
+            for symbol in batch:
+                self._next_due[symbol] = now + (self.hot_interval if symbol in hot else self.interval)
+
+        return refreshed
+
+    def _run(self):
+        tick = max(0.5, min(self.hot_interval, self.interval) / 2)
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.refresh_due()
+                except Exception as e:
+                    self.app.logger.exception("Price refresher pass failed: %s", e)
+            self._stop.wait(tick)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="price-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+price_refresher = PriceRefresher()
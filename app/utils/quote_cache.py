@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """An upstream fetch in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QuoteCache:
+    """
+    Per-symbol quote cache with a TTL, LRU eviction and single-flight fetches.
+
+    Concurrent misses for the same symbol share one call to the fetch
+    function; the other callers block until it returns and get its result
+    (or its exception).
+    """
+
+    def __init__(self, ttl=60, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # symbol -> (expires_at, quote)
+        self._flights = {}  # symbol -> _Flight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def init_app(self, app):
+        """Read the cache settings from the app config."""
+        self.ttl = app.config.get("QUOTE_CACHE_TTL", self.ttl)
+        self.maxsize = app.config.get("QUOTE_CACHE_SIZE", self.maxsize)
+        app.extensions["quote_cache"] = self
+
+    def _get_fresh(self, symbol, now):
+        # Must be called with the lock held. Expired entries stay (until evicted) for peek_stale()
+        entry = self._entries.get(symbol)
+        if entry is None:
+            return None
+        expires_at, quote = entry
+        if expires_at <= now:
+            return None
+        self._entries.move_to_end(symbol)
+        return quote
+
+    def _store(self, symbol, quote, now):
+        # Must be called with the lock held
+        self._entries[symbol] = (now + self.ttl, quote)
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, symbol):
+        """Return the cached quote for symbol, or None on a miss; never fetches or waits."""
+        with self._lock:
+            quote = self._get_fresh(symbol, time.monotonic())
+            if quote is not None:
+                self.hits += 1
+            return quote
+
+    def peek_stale(self, symbol):
+        """Return the last quote stored for symbol even if it has expired, or None; never fetches or waits."""
+        with self._lock:
+            entry = self._entries.get(symbol)
+            return None if entry is None else entry[1]
+
+    def get(self, symbol, fetch):
+        """Return the cached quote for symbol, calling fetch(symbol) on a miss."""
+        with self._lock:
+            quote = self._get_fresh(symbol, time.monotonic())
+            if quote is not None:
+                self.hits += 1
+                return quote
+
+            self.misses += 1
+            flight = self._flights.get(symbol)
+            leader = flight is None
+            if leader:
+                flight = self._flights[symbol] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fetch(symbol)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None and flight.value is not None:
+                    self._store(symbol, flight.value, time.monotonic())
+                del self._flights[symbol]
+            flight.done.set()
+
+        return flight.value
+
+    def get_many(self, symbols, fetch_many):
+        """
+        Return {symbol: quote} for symbols, calling fetch_many(missing) once for
+        every symbol that is neither cached nor already being fetched.
+
+        fetch_many must return a dict; symbols it leaves out map to None.
+        """
+        symbols = list(dict.fromkeys(symbols))
+        results = {}
+        owned = {}
+        waiting = {}
+
+        with self._lock:
+            now = time.monotonic()
+            for symbol in symbols:
+                quote = self._get_fresh(symbol, now)
+                if quote is not None:
+                    self.hits += 1
+                    results[symbol] = quote
+                    continue
+
+                self.misses += 1
+                flight = self._flights.get(symbol)
+                if flight is None:
+                    owned[symbol] = self._flights[symbol] = _Flight()
+                else:
+                    self.coalesced += 1
+                    waiting[symbol] = flight
+
+        if owned:
+            error = None
+            try:
+                fetched = fetch_many(list(owned))
+            except Exception as e:
+                fetched = {}
+                error = e
+            with self._lock:
+                now = time.monotonic()
+                for symbol, flight in owned.items():
+                    flight.error = error
+                    flight.value = fetched.get(symbol)
+                    if flight.value is not None:
+                        self._store(symbol, flight.value, now)
+                    del self._flights[symbol]
+            for flight in owned.values():
+                flight.done.set()
+            if error is not None:
+                raise error
+            for symbol, flight in owned.items():
+                results[symbol] = flight.value
+
+        for symbol, flight in waiting.items():
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            results[symbol] = flight.value
+
+        return {symbol: results.get(symbol) for symbol in symbols}
+
+    def put(self, symbol, quote):
+        """Store a quote fetched elsewhere."""
+        with self._lock:
+            self._store(symbol, quote, time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for sizing the cache."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+            }
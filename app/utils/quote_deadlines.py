@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from .helpers import lookup, lookup_many, quote_cache
+from .metrics import metrics
+from .shared_quotes import shared_quotes
+
+
+class QuoteDeadlineExceeded(Exception):
+    """Raised when an upstream quote does not arrive within QUOTE_DEADLINE."""
+
+
+class QuoteDeadlines:
+    """
+    Quote lookups for views that must not wait on upstream indefinitely.
+
+    Shared quote table and cache hits are answered straight away. Misses run
+    the usual lookup() (cache, single-flight, upstream budget) on a pool of
+    QUOTE_UPSTREAM_WORKERS threads and are waited for at most QUOTE_DEADLINE
+    seconds, after which the request gets a 504 instead of holding its worker.
+    A fetch that misses its deadline keeps running and fills the cache for the
+    next request. The pool is bounded, so a burst of slow quotes queues behind
+    it rather than piling up upstream calls. A QUOTE_DEADLINE of 0 disables
+    the deadline and looks quotes up on the request's own thread.
+    """
+
+    def __init__(self):
+        self.deadline = 5.0
+        self.workers = 32
+        self._pool = None
+
+    def init_app(self, app):
+        self.deadline = app.config.get("QUOTE_DEADLINE", self.deadline)
+        self.workers = app.config.get("QUOTE_UPSTREAM_WORKERS", self.workers)
+        # Threads are only started once work is submitted
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="quote-upstream")
+        app.extensions["quote_deadlines"] = self
+
+    def _call(self, fn, arg):
+        if not self.deadline or self._pool is None:
+            return fn(arg)
+        try:
+            return self._pool.submit(self._run_for, metrics.current(), fn, arg).result(self.deadline)
+        except TimeoutError:
+            raise QuoteDeadlineExceeded(f"no quote within {self.deadline:g}s") from None
+
+    @staticmethod
+    def _run_for(targets, fn, arg):
+        # The request's SQL and upstream metrics include what its lookup does on the pool
+        with metrics.attributed(targets):
+            return fn(arg)
+
+    def lookup(self, symbol):
+        """lookup(): the quote for symbol or None, raising QuoteDeadlineExceeded past the deadline."""
+        symbol = symbol.upper()
+        quote = shared_quotes.get(symbol) or quote_cache.peek(symbol)
+        if quote is not None:
+            return quote
+        return self._call(lookup, symbol)
+
+    def lookup_cached(self, symbols):
+        """
+        Quotes for symbols without waiting on upstream at all.
+
+        Returns ({symbol: quote}, pending). Fresh quotes come from the shared
+        table or the cache; for the pending symbols, which have none, the last
+        expired quote is used if the cache still holds one and None otherwise.
+        Pending symbols are fetched on the pool in the background, so a later
+        request finds them fresh.
+        """
+        quotes = {}
+        pending = []
+        for symbol in dict.fromkeys(symbol.upper() for symbol in symbols):
+            quote = shared_quotes.get(symbol) or quote_cache.peek(symbol)
+            if quote is None:
+                pending.append(symbol)
+                quote = quote_cache.peek_stale(symbol)
+            quotes[symbol] = quote
+        if pending and self._pool is not None:
+            self._pool.submit(self._prefetch, pending)
+        return quotes, pending
+
+    @staticmethod
+    def _prefetch(symbols):
+        try:
+            lookup_many(symbols)
+        except Exception:
+            # Nobody is waiting on it; the next request schedules another attempt
+            pass
+
+    def lookup_many(self, symbols):
+        """lookup_many(), raising QuoteDeadlineExceeded past the deadline."""
+        symbols = [symbol.upper() for symbol in symbols]
+        quotes = {symbol: shared_quotes.get(symbol) or quote_cache.peek(symbol) for symbol in symbols}
+        if all(quote is not None for quote in quotes.values()):
+            return quotes
+        return self._call(lookup_many, symbols)
+
+
+quote_deadlines = QuoteDeadlines()
@@ -0,0 +1,165 @@
+import json
+import threading
+import time
+
+from .helpers import quote_cache
+from .market_data import QuoteError, market_data
+from .rate_limit import UpstreamBudgetExceeded
+from .shared_quotes import shared_quotes
+
+
+class Subscription:
+    """One streaming client and the symbols it wants."""
+
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        # Latest unsent quote per symbol. A slow client never queues more than
+        # one update per symbol; newer prices simply replace older ones.
+        self.pending = {}
+        self.ready = threading.Event()
+        self.opened_at = time.monotonic()
+
+
+class QuoteFeed:
+    """
+    One shared price poller fanned out to Server-Sent Events clients.
+
+    Every QUOTE_STREAM_POLL_INTERVAL seconds the poller prices the union of
+    all subscribed symbols: fresh quotes come from the shared quote table or
+    the quote cache, and the rest are fetched in a single batch (so N viewers
+    of a symbol cost at most one upstream poll) and stored in the cache.
+    Changed prices are handed to the subscribers. The poller thread only runs
+    while someone is subscribed.
+
+    Streams send a comment every QUOTE_STREAM_HEARTBEAT seconds so dead
+    connections are noticed and dropped, and end after
+    QUOTE_STREAM_MAX_LIFETIME seconds, after which the browser's EventSource
+    reconnects on its own. On a sync server each open stream occupies a
+    worker thread, which is why quotes.js only opens one after the user asks
+    for live prices and closes it while the tab is hidden.
+    """
+
+    def __init__(self):
+        self.poll_interval = 5
+        self.heartbeat = 15
+        self.max_clients = 1000
+        self.max_lifetime = 30
+        self.max_symbols = 50
+        self.app = None
+        self._subscriptions = set()
+        self._last = {}  # symbol -> last published quote
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = app.config.get("QUOTE_STREAM_POLL_INTERVAL", self.poll_interval)
+        self.heartbeat = app.config.get("QUOTE_STREAM_HEARTBEAT", self.heartbeat)
+        self.max_clients = app.config.get("QUOTE_STREAM_MAX_CLIENTS", self.max_clients)
+        self.max_lifetime = app.config.get("QUOTE_STREAM_MAX_LIFETIME", self.max_lifetime)
+        self.max_symbols = app.config.get("QUOTE_STREAM_MAX_SYMBOLS", self.max_symbols)
+        app.extensions["quote_feed"] = self
+
+    def subscribe(self, symbols):
+        """Register a client; returns None when the feed is at capacity."""
+        subscription = Subscription(symbols)
+        with self._lock:
+            if len(self._subscriptions) >= self.max_clients:
+                return None
+            self._subscriptions.add(subscription)
+
+            # Start from the last known prices so the page fills in immediately
+            for symbol in subscription.symbols:
+                if symbol in self._last:
+                    subscription.pending[symbol] = self._last[symbol]
+            if subscription.pending:
+                subscription.ready.set()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="quote-feed", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscriptions:
+                    # Nobody is listening: stop polling until the next subscribe()
+                    self._thread = None
+                    self._last.clear()
+                    return
+                symbols = sorted(set().union(*(s.symbols for s in self._subscriptions)))
+
+            quotes = {}
+            missing = []
+            for symbol in symbols:
+                quote = shared_quotes.get(symbol) or quote_cache.peek(symbol)
+                if quote is None:
+                    missing.append(symbol)
+                else:
+                    quotes[symbol] = quote
+
+            fetched = {}
+            if missing:
+                try:
+                    fetched = market_data.get_quotes(missing)
+                except (QuoteError, UpstreamBudgetExceeded):
+                    # Tried again on the next poll
+                    pass
+                except Exception as e:
+                    self.app.logger.warning("Quote feed poll failed: %s", e)
+
+            for symbol, quote in fetched.items():
+                quote_cache.put(symbol, quote)
+            quotes.update(fetched)
+            self._publish(quotes)
+
+            time.sleep(self.poll_interval)
+
+    def _publish(self, quotes):
+        with self._lock:
+            changed = {symbol: quote for symbol, quote in quotes.items()
+                       if self._last.get(symbol, {}).get("price") != quote["price"]}
+            if not changed:
+                return
+            self._last.update(changed)
+
+            for subscription in self._subscriptions:
+                updates = {symbol: quote for symbol, quote in changed.items() if symbol in subscription.symbols}
+                if updates:
+                    subscription.pending.update(updates)
+                    subscription.ready.set()
+
+    def stream(self, subscription):
+        """Generate the Server-Sent Events for one client, unsubscribing it when done."""
+        try:
+            yield f"retry: {int(self.poll_interval * 1000)}\n\n"
+            while True:
+                remaining = self.max_lifetime - (time.monotonic() - subscription.opened_at)
+                if remaining <= 0:
+                    break
+                if not subscription.ready.wait(min(self.heartbeat, remaining)):
+                    if remaining > self.heartbeat:
+                        yield ": keepalive\n\n"
+                    continue
+
+                with self._lock:
+                    updates = subscription.pending
+                    subscription.pending = {}
+                    subscription.ready.clear()
+
+                for quote in updates.values():
+                    yield f"event: quote\ndata: {json.dumps(quote)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+
+quote_feed = QuoteFeed()
@@ -0,0 +1,119 @@
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import request, session
+from werkzeug.exceptions import TooManyRequests
+
+
+class UpstreamBudgetExceeded(Exception):
+    """
+    Raised instead of calling the market data provider once the upstream budget is spent.
+
+    Deliberately not a QuoteError: the symbol may be fine, we are just not
+    allowed to ask yet. retry_after is the number of seconds until we are.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"upstream budget exhausted, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class TokenBuckets:
+    """
+    Token buckets keyed by client: each key may spend burst tokens at once,
+    refilled at rate tokens per second.
+
+    State is two floats per active key. Keys that have been idle long enough
+    to refill completely hold no information, so they are pruned once there
+    are more than max_keys.
+    """
+
+    def __init__(self, rate, burst, max_keys=100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, cost=1):
+        """Spend cost tokens; returns 0 if allowed, else the seconds until it would be."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                if len(self._buckets) > self.max_keys:
+                    self._prune(now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / self.rate if self.rate > 0 else math.inf
+
+    def _prune(self, now):
+        # Must be called with the lock held
+        full_after = self.burst / self.rate if self.rate > 0 else math.inf
+        self._buckets = {key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+                         if now - updated < full_after}
+
+
+class RateLimiter:
+    """
+    Request and upstream rate limits, kept in memory per process.
+
+    Routes decorated with rate_limited spend a token from the client's
+    per-user bucket (keyed on the session's user id, so no database lookup is
+    needed) and from its per-IP bucket. When either is empty the request is
+    rejected with 429 and Retry-After before the view does any work.
+
+    Every call to the market data provider (quotes for lookup(), the price
+    refresher and the quote stream, and chart history) spends a token from
+    one global bucket, so however many clients miss the cache at once the
+    provider sees at most UPSTREAM_BUDGET_RATE calls a second. With several
+    worker processes, each has its own buckets, so divide the limits by the
+    worker count.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.users = None
+        self.ips = None
+        self.upstream = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get("RATE_LIMIT_ENABLED", False)
+        self.users = TokenBuckets(app.config["RATE_LIMIT_USER_RATE"], app.config["RATE_LIMIT_USER_BURST"])
+        self.ips = TokenBuckets(app.config["RATE_LIMIT_IP_RATE"], app.config["RATE_LIMIT_IP_BURST"])
+        self.upstream = TokenBuckets(app.config["UPSTREAM_BUDGET_RATE"], app.config["UPSTREAM_BUDGET_BURST"])
+        app.extensions["rate_limiter"] = self
+
+    def check_request(self):
+        """Spend the current request's tokens, raising TooManyRequests if a bucket is empty."""
+        wait = self.ips.take(request.remote_addr)
+        user_id = session.get("_user_id")
+        if not wait and user_id is not None:
+            wait = self.users.take(user_id)
+        if wait:
+            raise TooManyRequests(retry_after=math.ceil(wait))
+
+    def spend_upstream(self):
+        """Spend one upstream call from the global budget, raising UpstreamBudgetExceeded if there is none."""
+        if not self.enabled:
+            return
+        wait = self.upstream.take(None)
+        if wait:
+            raise UpstreamBudgetExceeded(math.ceil(wait))
+
+
+rate_limiter = RateLimiter()
+
+
+def rate_limited(view):
+    """Shed requests over the client's per-user or per-IP rate before the view runs."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if rate_limiter.enabled:
+            rate_limiter.check_request()
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,217 @@
+import fcntl
+import os
+import threading
+import time
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Identifies an initialised table; bump the last byte when SLOT changes
+MAGIC = 0x51554F01
+HEADER = np.dtype([("magic", "<u4"), ("slots", "<u4")])
+HEADER_SIZE = 64
+SLOT = np.dtype([("seq", "<u8"), ("symbol", "S16"), ("price", "<f8"), ("fetched_at", "<f8")])
+# Slots examined for a symbol before giving up, so a full table degrades to misses rather than scans
+MAX_PROBES = 32
+# Attempts at a consistent read of a slot while the writer is changing it
+READ_RETRIES = 8
+
+
+class SharedQuoteTable:
+    """
+    Quotes shared by every worker process through a fixed-layout shared memory table.
+
+    Each slot holds a symbol, its price, the wall-clock time it was fetched and
+    a sequence number. Symbols are placed by hash with linear probing and are
+    never moved, so readers need no lock: the writer makes the sequence number
+    odd, writes the fields and makes it even again, and a reader retries until
+    it sees the same even number before and after reading (a seqlock).
+
+    Exactly one process writes. The first process to take an exclusive flock on
+    SHARED_QUOTES_LOCK_FILE becomes the writer: it creates the table, and its
+    price refresher (always on with the table) and upstream fetches publish
+    into it. The other processes only read it, and their price refreshers
+    stand down, so a held symbol is fetched once however many workers there
+    are and every worker trades at the same price. A symbol nobody holds is
+    only in the table if the writer fetched it; other workers that miss it
+    fetch it themselves and keep it in their own cache. If the writer exits, its lock is released and the next process
+    to try (every refresher pass and every missing table attach) takes over.
+
+    Quotes older than QUOTE_CACHE_TTL are ignored, so a table left behind by a
+    dead writer never serves stale prices.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.name = "finance-quotes"
+        self.slots = 4096
+        self.lock_file = None
+        self.max_age = 60
+        self.retry_interval = 1.0  # Seconds between attempts to attach to a table that is not there yet
+        self.is_writer = False
+        self._shm = None
+        self._table = None
+        self._lock_fd = None
+        self._next_attach = 0.0
+        self._write_lock = threading.Lock()
+        self._attach_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("SHARED_QUOTES_ENABLED", False)
+        self.name = app.config.get("SHARED_QUOTES_NAME", self.name)
+        self.slots = app.config.get("SHARED_QUOTES_SLOTS", self.slots)
+        self.lock_file = app.config.get("SHARED_QUOTES_LOCK_FILE")
+        self.max_age = app.config.get("QUOTE_CACHE_TTL", self.max_age)
+        app.extensions["shared_quotes"] = self
+        if self.enabled:
+            self.claim_writer()
+            self._attach()
+
+    def claim_writer(self):
+        """Become the writer if no other process is; returns whether this process writes."""
+        if not self.enabled or self.is_writer:
+            return self.is_writer
+        with self._attach_lock:
+            fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._lock_fd = fd
+            self._detach()
+            self._create()
+            self.is_writer = True
+        return True
+
+    def _create(self):
+        # Must be called with _attach_lock held, by the process holding the writer lock
+        size = HEADER_SIZE + self.slots * SLOT.itemsize
+        try:
+            shm = shared_memory.SharedMemory(self.name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a previous writer: reuse it if its layout matches
+            shm = shared_memory.SharedMemory(self.name)
+            header = np.ndarray(1, HEADER, buffer=shm.buf)[0]
+            if shm.size < size or header["magic"] != MAGIC or header["slots"] != self.slots:
+                shm.close()
+                shm.unlink()
+                shm = shared_memory.SharedMemory(self.name, create=True, size=size)
+        self._map(shm)
+        header = np.ndarray(1, HEADER, buffer=shm.buf)
+        header["slots"] = self.slots
+        header["magic"] = MAGIC  # Written last: readers only attach to a table that is ready
+
+    def _attach(self):
+        """Map the writer's table if it exists; readers call this lazily until it does."""
+        with self._attach_lock:
+            if self._table is not None:
+                return True
+            self._next_attach = time.monotonic() + self.retry_interval
+            try:
+                shm = shared_memory.SharedMemory(self.name)
+            except FileNotFoundError:
+                return False
+            header = np.ndarray(1, HEADER, buffer=shm.buf)[0]
+            if header["magic"] != MAGIC:
+                shm.close()
+                return False
+            self.slots = int(header["slots"])
+            self._map(shm)
+            return True
+
+    def _map(self, shm):
+        # The table outlives any one process: stop Python's resource tracker from unlinking it at exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        self._shm = shm
+        self._table = np.ndarray(self.slots, SLOT, buffer=shm.buf, offset=HEADER_SIZE)
+        # Field views, made once since lookups read single elements of them
+        self._seq = self._table["seq"]
+        self._symbols = self._table["symbol"]
+        self._prices = self._table["price"]
+        self._fetched_at = self._table["fetched_at"]
+
+    def _detach(self):
+        if self._shm is not None:
+            self._table = None
+            self._shm.close()
+            self._shm = None
+
+    def _home(self, key):
+        return zlib.crc32(key) % self.slots
+
+    def _read(self, i):
+        """Consistent (symbol, price, fetched_at) of slot i, or None if the writer kept it busy."""
+        for _ in range(READ_RETRIES):
+            seq = int(self._seq[i])
+            if seq & 1:
+                continue
+            symbol = self._symbols[i]
+            price = float(self._prices[i])
+            fetched_at = float(self._fetched_at[i])
+            if int(self._seq[i]) == seq:
+                return symbol, price, fetched_at
+        return None
+
+    def get(self, symbol):
+        """The shared quote for symbol if it is fresh, else None."""
+        if not self.enabled:
+            return None
+        if self._table is None:
+            if time.monotonic() < self._next_attach or not (self.claim_writer() or self._attach()):
+                return None
+
+        key = symbol.encode()
+        if len(key) > SLOT["symbol"].itemsize:
+            return None
+        i = self._home(key)
+        for _ in range(MAX_PROBES):
+            slot = self._read(i)
+            if slot is None:
+                return None
+            stored, price, fetched_at = slot
+            if not stored:
+                return None
+            if stored == key:
+                if time.time() - fetched_at >= self.max_age:
+                    return None
+                return {"price": price, "symbol": symbol}
+            i = (i + 1) % self.slots
+        return None
+
+    def publish(self, quotes):
+        """Write quotes ({symbol: quote}) into the table; does nothing outside the writer process."""
+        if not self.is_writer:
+            return
+        now = time.time()
+        with self._write_lock:
+            for symbol, quote in quotes.items():
+                if quote is None:
+                    continue
+                key = symbol.encode()
+                if len(key) > SLOT["symbol"].itemsize:
+                    continue
+                i = self._home(key)
+                for _ in range(MAX_PROBES):
+                    stored = self._symbols[i]
+                    if not stored or stored == key:
+                        break
+                    i = (i + 1) % self.slots
+                else:
+                    continue  # No free slot near its home: left to each worker's own cache
+
+                seq = int(self._seq[i])
+                self._seq[i] = seq + 1
+                self._symbols[i] = key
+                self._prices[i] = quote["price"]
+                self._fetched_at[i] = now
+                self._seq[i] = seq + 2
+
+    def stats(self):
+        """Occupancy of the table, for sizing SHARED_QUOTES_SLOTS."""
+        used = 0 if self._table is None else int(np.count_nonzero(self._symbols))
+        return {"writer": self.is_writer, "slots": self.slots, "used": used}
+
+
+shared_quotes = SharedQuoteTable()
@@ -0,0 +1,50 @@
+import os
+import re
+import subprocess
+import sys
+import time
+
+# One line of `python -X importtime` output: self and cumulative microseconds, then the indented module name
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# Run in a fresh interpreter: imports the app and reports the wall time of doing so
+PROFILE_SCRIPT = """
+import time
+start = time.perf_counter()
+import app
+print("APP_IMPORT_SECONDS", time.perf_counter() - start)
+"""
+
+# Background work that importing the app could otherwise start in the profiling process
+QUIET_ENVIRONMENT = {"PRICE_REFRESHER_ENABLED": "0", "SHARED_QUOTES_ENABLED": "0", "METRICS_ENABLED": "0"}
+
+
+def profile_startup():
+    """
+    Import the app in a new interpreter with -X importtime.
+
+    Returns (modules, app_seconds, total_seconds): modules maps each imported
+    module to (self_seconds, cumulative_seconds, depth), app_seconds is the
+    wall time of `import app` and total_seconds also includes interpreter
+    start-up. Runs in a subprocess because modules already imported in this
+    one would not be timed.
+    """
+    env = dict(os.environ, **QUIET_ENVIRONMENT)
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROFILE_SCRIPT],
+                            capture_output=True, text=True, env=env, cwd=root, check=True)
+    total_seconds = time.perf_counter() - start
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us) / 1e6, int(cumulative_us) / 1e6, len(indent) // 2)
+
+    app_seconds = None
+    for line in result.stdout.splitlines():
+        if line.startswith("APP_IMPORT_SECONDS "):
+            app_seconds = float(line.split()[1])
+    return modules, app_seconds, total_seconds
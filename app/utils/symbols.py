@@ -0,0 +1,144 @@
+import csv
+import io
+import os
+import urllib.request
+from bisect import bisect_left
+
+# Exchange listings published by Nasdaq Trader, covering NASDAQ, NYSE and the other US exchanges
+LISTING_URLS = (
+    ("https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt", "Symbol"),
+    ("https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt", "ACT Symbol"),
+)
+
+
+def normalize_symbol(symbol):
+    """Ticker as the app stores and prices it: stripped and upper case."""
+    return symbol.strip().upper()
+
+
+class SymbolIndex:
+    """
+    Symbol master with a prefix index for autocomplete.
+
+    Tickers are kept in one sorted list, and company names in another as the
+    lower-cased suffix starting at each word ("apple inc.", "inc."). That way
+    "bank of am" finds "Bank of America Corporation". A prefix search is a
+    bisect into each list followed by a scan over the matches. That is
+    O(log n + k), a few microseconds for the full US listing.
+
+    Listing checks are opt-in: until a listing has been loaded (`flask
+    load-symbols` writes SYMBOL_LISTING_FILE), the index contains nothing and
+    is_listed() accepts every symbol, so non-US tickers and anything else the
+    provider can price can be traded.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.names = {}  # ticker -> company name
+        self._tickers = []
+        self._name_keys = []
+        self._name_tickers = []
+
+    def init_app(self, app):
+        self.path = app.config.get("SYMBOL_LISTING_FILE")
+        if self.path and os.path.exists(self.path):
+            self.load(self.path)
+        app.extensions["symbol_index"] = self
+
+    @property
+    def loaded(self):
+        return bool(self.names)
+
+    def load(self, path):
+        """Load a CSV listing with symbol and name columns, replacing the current index."""
+        with open(path, newline="", encoding="utf-8") as f:
+            self.build((row["symbol"], row["name"]) for row in csv.DictReader(f))
+
+    def build(self, listings):
+        names = {}
+        for symbol, name in listings:
+            symbol = normalize_symbol(symbol)
+            if symbol:
+                names[symbol] = name.strip()
+
+        name_entries = []
+        for symbol, name in names.items():
+            lowered = name.lower()
+            start = 0
+            while start < len(lowered):
+                name_entries.append((lowered[start:], symbol))
+                space = lowered.find(" ", start)
+                if space < 0:
+                    break
+                start = space + 1
+        name_entries.sort()
+
+        # Swap everything in at once so concurrent searches see either index, never a mix
+        self._tickers, self._name_keys, self._name_tickers, self.names = (
+            sorted(names),
+            [key for key, _ in name_entries],
+            [symbol for _, symbol in name_entries],
+            names,
+        )
+
+    def is_listed(self, symbol):
+        """False only for symbols missing from a loaded listing."""
+        return not self.names or normalize_symbol(symbol) in self.names
+
+    def search(self, query, limit=10):
+        """
+        Up to limit {"symbol", "name"} matches: ticker prefix matches first,
+        then company name matches.
+        """
+        tickers, names = self._tickers, self.names
+        query = query.strip()
+        if not query or limit <= 0:
+            return []
+
+        found = []
+        prefix = normalize_symbol(query)
+        i = bisect_left(tickers, prefix)
+        while i < len(tickers) and len(found) < limit and tickers[i].startswith(prefix):
+            found.append(tickers[i])
+            i += 1
+
+        keys, key_tickers = self._name_keys, self._name_tickers
+        prefix = query.lower()
+        i = bisect_left(keys, prefix)
+        seen = set(found)
+        while i < len(keys) and len(found) < limit and keys[i].startswith(prefix):
+            if key_tickers[i] not in seen:
+                seen.add(key_tickers[i])
+                found.append(key_tickers[i])
+            i += 1
+
+        return [{"symbol": symbol, "name": names[symbol]} for symbol in found]
+
+
+def download_listings(timeout=30):
+    """Fetch the current US exchange listings as (symbol, name) pairs, skipping test issues."""
+    listings = []
+    for url, symbol_column in LISTING_URLS:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            text = response.read().decode("utf-8", errors="replace")
+        for row in csv.DictReader(io.StringIO(text), delimiter="|"):
+            symbol = row.get(symbol_column)
+            # The last line is "File Creation Time: ..." rather than a listing
+            if not symbol or row.get("Test Issue") != "N":
+                continue
+            # Share classes are written BRK.B here but BRK-B by the quote providers
+            listings.append((symbol.replace(".", "-"), row["Security Name"]))
+    return listings
+
+
+def write_listing(path, listings):
+    """Write (symbol, name) pairs as the CSV listing SymbolIndex.load() reads."""
+    rows = sorted({normalize_symbol(symbol): name.strip() for symbol, name in listings}.items())
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["symbol", "name"])
+        writer.writerows(rows)
+    return len(rows)
+
+
+symbol_index = SymbolIndex()
@@ -0,0 +1,123 @@
+import sqlalchemy as sa
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .models import RealizedGain, RealizedGainSummary, StockPortfolio, TaxLot
+from app import db
+
+# Written as a literal so SQLite can match it to the partial ix_tax_lots_open index
+LOT_IS_OPEN = TaxLot.__table__.c.remaining > sa.literal_column("0")
+
+
+def period_of(when):
+    """The 'YYYY-MM' summary period of a datetime or of SQLite's datetime text."""
+    return when.strftime("%Y-%m") if hasattr(when, "strftime") else str(when)[:7]
+
+
+def open_lot(user_id, symbol, quantity, price, transaction_id, opened_at):
+    """Record the shares bought by one purchase as a new open lot."""
+    db.session.execute(sa.insert(TaxLot.__table__).values(
+        user_id=user_id, stock_id=symbol, transaction_id=transaction_id,
+        quantity=quantity, remaining=quantity, price=price, opened_at=opened_at,
+    ))
+
+
+def consume_lots(user_id, symbol, quantity, price, transaction_id, realized_at, fallback_cost):
+    """
+    Sell quantity shares out of the position's open lots, oldest first.
+
+    Walks the open-lots index only as far as the sale needs, records a
+    RealizedGain per lot touched and adds the sale to the month's summary.
+    Shares not covered by lots (positions opened before lots were recorded)
+    are realized at fallback_cost, the position's cost basis. The position's
+    cost basis is then reset to that of its remaining lots.
+
+    Returns the realized gain and the position's new cost basis (None once
+    the position is closed). Runs in the caller's transaction.
+    """
+    lots = TaxLot.__table__
+    open_lots = db.session.execute(
+        sa.select(lots.c.id, lots.c.remaining, lots.c.price)
+        .where(lots.c.user_id == user_id, lots.c.stock_id == symbol, LOT_IS_OPEN)
+        .order_by(lots.c.opened_at, lots.c.id)
+    )
+    consumed = []
+    left = quantity
+    for lot in open_lots:
+        used = min(lot.remaining, left)
+        consumed.append((lot, used))
+        left -= used
+        if left <= 0:
+            break
+    open_lots.close()
+
+    gains = [
+        {"lot_id": lot.id, "quantity": used, "cost_price": lot.price, "gain": used * (price - lot.price)}
+        for lot, used in consumed
+    ]
+    if left > 0:
+        gains.append({"lot_id": None, "quantity": left, "cost_price": fallback_cost,
+                      "gain": left * (price - fallback_cost)})
+
+    if consumed:
+        db.session.execute(
+            sa.update(lots).where(lots.c.id == sa.bindparam("lot_id")).values(remaining=sa.bindparam("left")),
+            [{"lot_id": lot.id, "left": lot.remaining - used} for lot, used in consumed],
+        )
+    db.session.execute(sa.insert(RealizedGain.__table__), [
+        dict(gain, user_id=user_id, stock_id=symbol, sale_transaction_id=transaction_id,
+             sale_price=price, realized_at=realized_at)
+        for gain in gains
+    ])
+
+    cost = sum(gain["quantity"] * gain["cost_price"] for gain in gains)
+    add_to_summary([(user_id, symbol, period_of(realized_at), quantity, quantity * price, cost)])
+
+    # Whatever lots are left now define the position's cost basis
+    open_basis = (
+        sa.select(sa.func.sum(lots.c.remaining * lots.c.price) / sa.func.sum(lots.c.remaining))
+        .where(lots.c.user_id == user_id, lots.c.stock_id == symbol, LOT_IS_OPEN)
+        .scalar_subquery()
+    )
+    portfolio = StockPortfolio.__table__
+    basis = db.session.execute(
+        sa.update(portfolio)
+        .where(portfolio.c.user_id == user_id, portfolio.c.stock_id == symbol)
+        .values(buy_price=sa.func.coalesce(open_basis, portfolio.c.buy_price))
+        .returning(portfolio.c.buy_price)
+    ).scalar_one_or_none()
+
+    return quantity * price - cost, basis
+
+
+def add_to_summary(sales):
+    """Add (user_id, symbol, period, quantity, proceeds, cost) sales to the per-month totals."""
+    summary = RealizedGainSummary.__table__
+    stmt = sqlite_insert(summary)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[summary.c.user_id, summary.c.stock_id, summary.c.period],
+        set_={
+            "quantity": summary.c.quantity + stmt.excluded.quantity,
+            "proceeds": summary.c.proceeds + stmt.excluded.proceeds,
+            "cost": summary.c.cost + stmt.excluded.cost,
+            "gain": summary.c.gain + stmt.excluded.gain,
+        },
+    )
+    db.session.execute(stmt, [
+        {"user_id": user_id, "stock_id": symbol, "period": period, "quantity": quantity,
+         "proceeds": proceeds, "cost": cost, "gain": proceeds - cost}
+        for user_id, symbol, period, quantity, proceeds, cost in sales
+    ])
+
+
+def realized_gain(user_id, symbol=None, period=None):
+    """
+    Total realized gain of a user, optionally for one symbol and/or one period
+    ('YYYY' for a year, 'YYYY-MM' for a month), read from the summary table.
+    """
+    summary = RealizedGainSummary.__table__
+    query = sa.select(sa.func.coalesce(sa.func.sum(summary.c.gain), 0.0)).where(summary.c.user_id == user_id)
+    if symbol is not None:
+        query = query.where(summary.c.stock_id == symbol.upper())
+    if period is not None:
+        query = query.where(summary.c.period.startswith(period, autoescape=True))
+    return db.session.scalar(query)
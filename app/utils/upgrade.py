@@ -0,0 +1,91 @@
+import sqlalchemy as sa
+
+from .account_ledger import reconcile
+from .models import StockPortfolio, TaxLot, TransactionHistory
+from .positions import replay_history, write_ledger
+from app import db
+
+
+def merge_duplicate_positions(connection):
+    """
+    Fold every (user, symbol) with several stock_portfolio rows into its
+    oldest row, with the summed quantity and the quantity-weighted buy price,
+    and upper-case every symbol, so the unique index apply_buy's upsert relies
+    on can be built. Symbols are compared upper-cased: earlier versions
+    stored them as typed, so 'nflx' and 'NFLX' are the same position, and
+    orders now always use the upper-cased symbol. Returns the number of rows
+    removed.
+    """
+    portfolio = StockPortfolio.__table__
+    symbol = sa.func.upper(portfolio.c.stock_id)
+    duplicates = connection.execute(
+        sa.select(sa.func.min(portfolio.c.id), portfolio.c.user_id, symbol,
+                  sa.func.sum(portfolio.c.quantity), sa.func.sum(portfolio.c.quantity * portfolio.c.buy_price),
+                  sa.func.count())
+        .group_by(portfolio.c.user_id, symbol)
+        .having(sa.func.count() > 1)
+    ).all()
+
+    removed = 0
+    for keep_id, user_id, upper_symbol, quantity, cost, count in duplicates:
+        # Delete before updating, so the kept row never collides with another on the unique index
+        connection.execute(
+            sa.delete(portfolio).where(portfolio.c.user_id == user_id, symbol == upper_symbol,
+                                       portfolio.c.id != keep_id)
+        )
+        connection.execute(
+            sa.update(portfolio).where(portfolio.c.id == keep_id)
+            .values(quantity=quantity, buy_price=cost / quantity if quantity else 0.0)
+        )
+        removed += count - 1
+
+    connection.execute(sa.update(portfolio).where(portfolio.c.stock_id != symbol).values(stock_id=symbol))
+    history = TransactionHistory.__table__
+    connection.execute(sa.update(history).where(history.c.stock_id != sa.func.upper(history.c.stock_id))
+                       .values(stock_id=sa.func.upper(history.c.stock_id)))
+    return removed
+
+
+def backfill_tax_lots():
+    """
+    Fill an empty tax-lot ledger by replaying transaction_history, so sales
+    of shares bought before it existed consume lots at their real cost and
+    earlier sales show up in realized P&L. stock_portfolio is left as it is;
+    rebuild-positions replaces it with the positions history implies. Returns
+    the number of lots written, 0 if the ledger already had any.
+    """
+    if db.session.scalar(sa.select(TaxLot.id).limit(1)) is not None:
+        return 0
+    lots, gains, summary, _ = replay_history()
+    write_ledger(lots, gains, summary, [])
+    db.session.commit()
+    return len(lots)
+
+
+def upgrade_database():
+    """
+    Bring a database created by an earlier version up to the current models.
+
+    create_all() only creates missing tables, so indexes added to existing
+    tables since (the stock_portfolio unique index, the history keyset index)
+    are created here as well, after upper-casing symbols and merging any
+    duplicate positions. Then the tax-lot ledger is backfilled from history,
+    and accounts without an account ledger snapshot adopt their current cash
+    and holdings as one, so reconcile checks them from here on. Safe to run
+    again on an up-to-date database. Returns counts of what was done.
+    """
+    connection = db.session.connection(bind_arguments={"clause": sa.delete(StockPortfolio.__table__)})
+    tables_before = set(sa.inspect(connection).get_table_names())
+    db.metadata.create_all(connection)
+    merged = merge_duplicate_positions(connection)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    db.session.commit()
+
+    return {
+        "tables": len(set(db.metadata.tables) - tables_before),
+        "merged_positions": merged,
+        "tax_lots": backfill_tax_lots(),
+        "snapshots": reconcile(adopt=True).snapshots,
+    }
@@ -0,0 +1,166 @@
+import math
+
+import numpy as np
+import sqlalchemy as sa
+
+from .helpers import lookup_many
+from .models import StockPortfolio, User
+from app import db
+
+
+def _or_none(value):
+    """Convert a numpy scalar to a float, with NaN (unpriced) as None for the templates."""
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+class PortfolioValuation:
+    """
+    Market value and unrealized P&L of one portfolio, computed in a single
+    vectorized pass over its positions.
+
+    Positions without a current price are reported with None for every
+    market-dependent figure and left out of the totals and weights.
+    """
+
+    def __init__(self, symbols, quantities, cost_basis, prices, cash=0.0):
+        self.symbols = list(symbols)
+        self.quantities = np.asarray(quantities, dtype=float)
+        self.cost_basis = np.asarray(cost_basis, dtype=float)
+        self.prices = np.array([np.nan if price is None else price for price in prices], dtype=float)
+        self.cash = float(cash)
+
+        self.cost = self.quantities * self.cost_basis
+        self.market_value = self.quantities * self.prices
+        self.pnl = self.market_value - self.cost
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.pnl_pct = np.where(self.cost != 0, self.pnl / self.cost * 100, np.nan)
+
+        priced = ~np.isnan(self.prices)
+        self.total_market_value = float(self.market_value[priced].sum())
+        self.total_cost = float(self.cost[priced].sum())
+        self.total_pnl = self.total_market_value - self.total_cost
+        self.total_pnl_pct = self.total_pnl / self.total_cost * 100 if self.total_cost else None
+        self.total_value = self.cash + self.total_market_value
+
+        if self.total_market_value:
+            self.weights = self.market_value / self.total_market_value * 100
+        else:
+            self.weights = np.full(len(self.symbols), np.nan)
+
+    def rows(self):
+        """One display-ready dict per position."""
+        columns = zip(self.symbols, self.quantities.tolist(), self.cost_basis.tolist(), self.prices,
+                      self.market_value, self.pnl, self.pnl_pct, self.weights)
+        return [
+            {
+                "stock_id": symbol,
+                "total_quantity": int(quantity),
+                "average_price": cost_basis,
+                "current_price": _or_none(price),
+                "market_value": _or_none(market_value),
+                "pnl": _or_none(pnl),
+                "pnl_pct": _or_none(pnl_pct),
+                "weight": _or_none(weight),
+            }
+            for symbol, quantity, cost_basis, price, market_value, pnl, pnl_pct, weight in columns
+        ]
+
+
+def held_positions(user_id):
+    """The user's positions as (stock_id, quantity, buy_price) rows, ordered by symbol."""
+    return db.session.execute(
+        sa.select(StockPortfolio.stock_id, StockPortfolio.quantity, StockPortfolio.buy_price)
+        .where(StockPortfolio.user_id == user_id)
+        .order_by(StockPortfolio.stock_id)
+    ).all()
+
+
+def value_positions(positions, quotes, cash=0.0):
+    """Value rows from held_positions() against quotes, a {symbol: quote} dict."""
+    symbols = [position.stock_id for position in positions]
+    prices = [(quotes.get(symbol.upper()) or {}).get("price") for symbol in symbols]
+
+    return PortfolioValuation(
+        symbols,
+        [position.quantity for position in positions],
+        [position.buy_price for position in positions],
+        prices,
+        cash=cash,
+    )
+
+
+def value_accounts(user_ids, cash, position_user_ids, symbols, quantities, cost_basis, quotes):
+    """
+    Value many accounts at once.
+
+    user_ids/cash describe the accounts; the position_* arrays hold one entry
+    per position across all of them, and quotes maps symbol -> price (or None).
+    Returns a dict of arrays aligned with user_ids: holdings (market value of
+    priced positions), cost, pnl and total (cash + holdings).
+    """
+    user_ids = np.asarray(user_ids)
+    cash = np.asarray(cash, dtype=float)
+    holdings = np.zeros(len(user_ids))
+    cost = np.zeros(len(user_ids))
+
+    if len(symbols):
+        # Price each distinct symbol once, then broadcast back to the positions
+        unique_symbols, symbol_index = np.unique(np.asarray(symbols, dtype=str), return_inverse=True)
+        unique_prices = np.array([np.nan if quotes.get(symbol) is None else quotes[symbol]
+                                  for symbol in unique_symbols], dtype=float)
+        prices = unique_prices[symbol_index]
+
+        quantities = np.asarray(quantities, dtype=float)
+        market_value = quantities * prices
+        position_cost = quantities * np.asarray(cost_basis, dtype=float)
+        priced = ~np.isnan(prices)
+
+        # Map each position to its account's row, then sum per account
+        order = np.argsort(user_ids)
+        account_index = order[np.searchsorted(user_ids, np.asarray(position_user_ids), sorter=order)]
+        holdings = np.bincount(account_index[priced], weights=market_value[priced], minlength=len(user_ids))
+        cost = np.bincount(account_index[priced], weights=position_cost[priced], minlength=len(user_ids))
+
+    return {
+        "user_ids": user_ids,
+        "holdings": holdings,
+        "cost": cost,
+        "pnl": holdings - cost,
+        "total": cash + holdings,
+    }
+
+
+def value_all_accounts():
+    """
+    Value every account with one query and one batched quote lookup.
+
+    Accounts and their positions come back together from a single outer join,
+    the union of held symbols is priced in one lookup_many() call and the rest
+    is vectorized in value_accounts().
+    """
+    rows = db.session.execute(
+        sa.select(User.id, User.cash, StockPortfolio.stock_id, StockPortfolio.quantity, StockPortfolio.buy_price)
+        .outerjoin(StockPortfolio, StockPortfolio.user_id == User.id)
+        .order_by(User.id)
+    ).all()
+    if not rows:
+        return value_accounts([], [], [], [], [], [], {})
+
+    user_ids, cash, symbols, quantities, cost_basis = (np.array(column, dtype=object) for column in zip(*rows))
+    user_ids = user_ids.astype(np.int64)
+    # One row per account for those without positions, one per position for the rest
+    account_ids, first_rows = np.unique(user_ids, return_index=True)
+    held = np.array([symbol is not None for symbol in symbols], dtype=bool)
+    symbols = np.char.upper(symbols[held].astype(str))
+    quotes = lookup_many(set(symbols.tolist()))
+
+    return value_accounts(
+        account_ids,
+        cash[first_rows].astype(float),
+        user_ids[held],
+        symbols,
+        quantities[held].astype(float),
+        cost_basis[held].astype(float),
+        {symbol: (quote or {}).get("price") for symbol, quote in quotes.items()},
+    )
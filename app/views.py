@@ -1,10 +1,25 @@
 from app import app
+import time
 import sqlalchemy as sa
-from flask import render_template, redirect, url_for, flash, request
+from datetime import datetime
+from flask import render_template, redirect, url_for, flash, request, jsonify, make_response, Response, stream_with_context
 from werkzeug.security import check_password_hash, generate_password_hash
 from flask_login import current_user, login_user, logout_user, login_required
-from .utils.helpers import apology, lookup
-from .utils.models import User, StockPortfolio, TransactionHistory
+from .utils.account_ledger import record_entry
+from .utils.helpers import apology
+from .utils.history_export import EXPORT_FORMATS
+from .utils.http_cache import NO_STORE, apply_cache_policy, etag_cached
+from .utils.identity import account_state, identity
+from .utils.leaderboard import leaderboard
+from .utils.models import User, TransactionHistory
+from .utils.orders import OrderRejected, order_engine
+from .utils.price_history import SYMBOL_PATTERN, HistoryUnavailable, lttb, price_history
+from .utils.quote_deadlines import QuoteDeadlineExceeded, quote_deadlines
+from .utils.quote_stream import quote_feed
+from .utils.rate_limit import UpstreamBudgetExceeded, rate_limited
+from .utils.symbols import normalize_symbol, symbol_index
+from .utils.tax_lots import realized_gain
+from .utils.valuation import held_positions, value_positions
 
 from app import db
 
@@ -13,48 +28,100 @@ from app import db
 
 @app.after_request
 def after_request(response):
-    """Ensure responses aren't cached"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
-    return response
+    """Apply the default cache policy to responses whose route didn't set one"""
+    return apply_cache_policy(response)
+
+
+# Routes answering in JSON, whose errors are JSON too
+JSON_PATHS = ("/api/", "/chart/", "/stream/")
+
+
+@app.errorhandler(429)
+def too_many_requests(e):
+    """Tell a client over its rate limit when to come back"""
+    if request.path.startswith(JSON_PATHS):
+        return jsonify(error="too many requests, slow down", reason="rate_limited"), 429, e.get_headers()
+    body, code = apology("too many requests, slow down", 429)
+    return body, code, e.get_headers()
+
+
+@app.errorhandler(UpstreamBudgetExceeded)
+def upstream_budget_exceeded(e):
+    """Prices can't be fetched right now; the symbol itself may be fine, so say when to retry"""
+    headers = {"Retry-After": str(e.retry_after)}
+    if request.path.startswith(JSON_PATHS):
+        return jsonify(error="market data is busy, try again shortly", reason="upstream_busy"), 503, headers
+    body, code = apology("market data is busy, try again shortly", 503)
+    return body, code, headers
+
+
+# Shown when the engine is still executing an order after ORDER_TIMEOUT: it will go through, just late
+ORDER_PENDING_MESSAGE = "Your order is still being executed, check your history in a moment before retrying"
+
+
+@app.errorhandler(QuoteDeadlineExceeded)
+def quote_deadline_exceeded(e):
+    """Give up on a quote the market data provider is too slow to return"""
+    return apology("quote service is slow, try again", 504)
+
+
+def latest_transaction_id(user_id):
+    """Id of the user's most recent transaction, which changes whenever their history does"""
+    return db.session.scalar(
+        sa.select(sa.func.max(TransactionHistory.id)).where(TransactionHistory.user_id == user_id)
+    )
+
+
+def history_etag():
+    return current_user.id, latest_transaction_id(current_user.id)
+
+
+def portfolio_etag():
+    # Prices come from the quote cache, so the page can change at most once per cache TTL
+    price_epoch = int(time.time() // app.config["QUOTE_CACHE_TTL"])
+    state = account_state(current_user.id)
+    return current_user.id, state.latest_transaction_id, state.cash, price_epoch
 
 
 @app.route("/")
 @login_required
+@etag_cached(portfolio_etag)
 def index():
     """Show portfolio of stocks"""
     user_id = current_user.id
-
-    # Fetch the username using the ORM
-    user = db.session.get(User, user_id)
-    username = user.username if user else "Unknown User"  # Fallback in case the user is not found
-
-    # Fetch the stock portfolio using the ORM
-    stocks = (
-        db.session.query(
-            StockPortfolio.stock_id,
-            sa.func.sum(StockPortfolio.quantity).label('total_quantity'),
-            sa.func.round(sa.func.avg(StockPortfolio.buy_price), 2).label('average_price')
-        )
-        .filter(StockPortfolio.user_id == user_id)
-        .group_by(StockPortfolio.stock_id)
-        .all()
-    )
-
-    return render_template("index.html", username=username, stocks=stocks)
+    username = current_user.username
+
+    # Value the user's positions against the prices already known, so the dashboard never waits on upstream
+    positions = held_positions(user_id)
+    quotes, pending = quote_deadlines.lookup_cached([position.stock_id for position in positions])
+    valuation = value_positions(positions, quotes, cash=account_state(user_id).cash)
+    # Realized gains only change with a sale, which the ETag's latest transaction id already covers
+    realized = realized_gain(user_id)
+
+    response = make_response(render_template("index.html", username=username, stocks=valuation.rows(),
+                                              valuation=valuation, pending=pending, realized=realized))
+    if pending:
+        # Prices are being fetched; an ETag would let a reload within the same price epoch keep the old ones
+        response.headers["Cache-Control"] = NO_STORE
+    return response
 
 @app.route("/buy", methods=["GET", "POST"])
+@rate_limited
 @login_required
 def buy():
     """Buy shares of stock"""
     if request.method == "POST":
-        # Validate form inputs
-        symbol = request.form.get("symbol")
+        # Validate form inputs; the symbol is checked and ordered in the same form
+        symbol = normalize_symbol(request.form.get("symbol") or "")
         if not symbol:
             flash("Please enter a valid symbol", "failure")
             return redirect("/buy", 400)
 
+        # Reject symbols missing from the listing before paying for an upstream quote
+        if not symbol_index.is_listed(symbol):
+            flash("Please enter a valid symbol", "failure")
+            return redirect("/buy", 400)
+
         try:
             quantity = float(request.form.get("shares"))
             if quantity <= 0:
@@ -64,109 +131,148 @@ def buy():
             flash("Please enter a valid quantity", "failure")
             return redirect("/buy", 400)
 
-        # Look up the stock
-        stock_data = lookup(symbol)
-        if not stock_data:
-            flash("Please enter a valid symbol", "failure")
+        # Queue the order; it is priced and executed with any others for the same symbol
+        try:
+            order_engine.execute(current_user.id, "buy", symbol, quantity)
+        except OrderRejected as e:
+            if e.reason == "insufficient_cash":
+                return apology(e.message)
+            if e.reason == "timeout":
+                return apology(e.message, 503)
+            flash(e.message, "failure")
             return redirect("/buy", 400)
+        except TimeoutError:
+            flash(ORDER_PENDING_MESSAGE, "info")
+            return redirect("/history")
+        except UpstreamBudgetExceeded:
+            # Answered by its error handler: nothing was traded and the user should retry
+            raise
+        except Exception as e:
+            flash(f"An error occurred: {e}", 'error')
+            return redirect("/")
 
-        stock_price = stock_data['price']
-        total_price = stock_price * quantity
+        flash('Purchase successful!', 'success')
+        return redirect("/")
 
-        # Fetch the current user's cash balance
-        user = db.session.get(User, current_user.id)
-        if not user:
-            flash("User not found", "failure")
-            return redirect("/buy", 400)
+    return render_template("buy.html")
 
-        user_cash = user.cash
+# HTTP status of each OrderRejected reason for the JSON trade endpoints
+ORDER_REJECTED_STATUS = {"unknown_symbol": 404, "insufficient_cash": 400, "insufficient_shares": 400, "timeout": 503}
 
-        # Check if the user has enough cash
-        if user_cash < total_price:
-            return apology("Not enough cash in account!")
 
-        try:
-            # Deduct the total price from the user's cash
-            user.cash -= total_price
-
-            # Add a new transaction to the transaction history
-            transaction = TransactionHistory(
-                user_id=current_user.id,
-                stock_id=symbol,
-                transaction_type='buy',
-                quantity=quantity,
-                price=stock_price
-            )
-            db.session.add(transaction)
-
-            # Update or add to the user's stock portfolio
-            portfolio_entry = db.session.query(StockPortfolio).filter(
-                StockPortfolio.user_id == current_user.id,
-                StockPortfolio.stock_id == symbol
-            ).first()
-
-            if portfolio_entry:
-                # If the stock already exists in the portfolio, update the quantity and average price
-                total_quantity = portfolio_entry.quantity + quantity
-                total_cost = (portfolio_entry.quantity * portfolio_entry.buy_price) + (quantity * stock_price)
-                average_price = total_cost / total_quantity
-
-                portfolio_entry.quantity = total_quantity
-                portfolio_entry.buy_price = average_price
-            else:
-                # If the stock is not in the portfolio, create a new entry
-                portfolio_entry = StockPortfolio(
-                    user_id=current_user.id,
-                    stock_id=symbol,
-                    quantity=quantity,
-                    buy_price=stock_price
-                )
-                db.session.add(portfolio_entry)
-
-            # Commit all changes to the database
-            db.session.commit()
-            flash('Purchase successful!', 'success')
+def trade_json(side):
+    """Execute a buy or sell from a JSON (or form) body and return what it changed as JSON"""
+    data = request.get_json(silent=True) or request.form
+    symbol = normalize_symbol(data.get("symbol") or "")
+    # Sales need no listing check: only held symbols can be sold
+    if not symbol or (side == "buy" and not symbol_index.is_listed(symbol)):
+        return jsonify(error="Please enter a valid symbol", reason="unknown_symbol"), 400
 
-        except Exception as e:
-            # Rollback all changes if any operation fails
-            db.session.rollback()
-            flash(f"An error occurred: {e}", 'error')
+    try:
+        quantity = int(data.get("quantity"))
+    except (ValueError, TypeError):
+        quantity = 0
+    if quantity <= 0:
+        return jsonify(error="Please enter a valid quantity", reason="invalid_quantity"), 400
 
-        return redirect("/")
+    try:
+        result = order_engine.execute(current_user.id, side, symbol, quantity)
+    except OrderRejected as e:
+        return jsonify(error=e.message, reason=e.reason), ORDER_REJECTED_STATUS.get(e.reason, 400)
+    except TimeoutError:
+        # Accepted but not done: the client must not resubmit
+        return jsonify(status="pending", message=ORDER_PENDING_MESSAGE), 202
+
+    return jsonify(result.as_dict())
+
+
+@app.route("/api/buy", methods=["POST"])
+@rate_limited
+@login_required
+def api_buy():
+    """Buy shares and return the new position and cash balance, without a redirect or page render"""
+    return trade_json("buy")
+
+
+@app.route("/api/sell", methods=["POST"])
+@rate_limited
+@login_required
+def api_sell():
+    """Sell shares and return the new position, cash balance and realized gain"""
+    return trade_json("sell")
 
-    return render_template("buy.html")
 
 @app.route("/history")
 @login_required
+@etag_cached(history_etag)
 def history():
     """Show history of transactions"""
     user_id = current_user.id
-
-    # Fetch the username using the ORM
-    user = db.session.get(User, user_id)
-    username = user.username if user else "Unknown User"  # Fallback in case the user is not found
-
-    # Fetch the transaction history using the ORM
-    transactions = (
-        db.session.query(TransactionHistory)
-        .filter(TransactionHistory.user_id == user_id)
-        .all()
+    username = current_user.username
+
+    # Page size, clamped so a single request stays cheap
+    per_page = request.args.get("per_page", app.config["HISTORY_PAGE_SIZE"], type=int)
+    per_page = max(1, min(per_page, app.config["HISTORY_MAX_PAGE_SIZE"]))
+
+    # Fetch one page of the transaction history, newest first, seeking past the cursor.
+    # The cursor keeps transaction_time as stored so that it compares exactly like ORDER BY does.
+    time_key = sa.type_coerce(TransactionHistory.transaction_time, sa.String)
+    query = (
+        sa.select(
+            TransactionHistory.id,
+            TransactionHistory.stock_id,
+            TransactionHistory.transaction_type,
+            TransactionHistory.quantity,
+            TransactionHistory.price,
+            TransactionHistory.transaction_time,
+            time_key.label("time_key"),
+        )
+        .where(TransactionHistory.user_id == user_id)
+        .order_by(TransactionHistory.transaction_time.desc(), TransactionHistory.id.desc())
+        .limit(per_page + 1)
     )
 
-    # Format the transactions for the template
-    stocks = []
-    for transaction in transactions:
-        stock = {
-            "stock_id": transaction.stock_id,
-            "transaction_type": transaction.transaction_type,
-            "quantity": transaction.quantity,
-            "price": transaction.price,
-            "transactionTime": transaction.transaction_time.strftime('%Y-%m-%d %H:%M:%S'),
-            "formatted_time": transaction.transaction_time.strftime('%B %d %Y at %I:%M %p')
-        }
-        stocks.append(stock)
-
-    return render_template("history.html", username=username, stocks=stocks)
+    before = request.args.get("before")
+    if before:
+        try:
+            before_time, before_id = before.rsplit("_", 1)
+            datetime.fromisoformat(before_time)
+            before_id = int(before_id)
+        except ValueError:
+            return apology("invalid page", 400)
+        query = query.where(sa.tuple_(time_key, TransactionHistory.id) < (before_time, before_id))
+
+    stocks = db.session.execute(query).all()
+
+    # The extra row only tells us whether there is an older page
+    next_cursor = None
+    if len(stocks) > per_page:
+        stocks = stocks[:per_page]
+        last = stocks[-1]
+        next_cursor = f"{last.time_key}_{last.id}"
+
+    return render_template("history.html", username=username, stocks=stocks,
+                           per_page=per_page, next_cursor=next_cursor, paged=bool(before))
+
+@app.route("/history/export")
+@login_required
+def export_history():
+    """Download the full transaction history as ?format=csv or jsonl"""
+    export_format = request.args.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        return apology("unsupported export format", 400)
+    mimetype, generate = EXPORT_FORMATS[export_format]
+
+    # Stream rows straight from the cursor; the request context (and DB session) stays open until the last chunk
+    rows = generate(current_user.id, app.config["HISTORY_EXPORT_BATCH_SIZE"])
+    return Response(
+        stream_with_context(rows),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="transactions.{export_format}"',
+            "X-Accel-Buffering": "no",
+        },
+    )
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
@@ -195,8 +301,8 @@ def login():
         # Remember which user has logged in
         # login_user(user, remember=form.remember_me.data)
 
-        # Log the user in using Flask-Login (if you're using Flask-Login)
-        login_user(user)
+        # Log the user in using Flask-Login, caching their snapshot for later requests
+        login_user(identity.remember(user))
 
         # Redirect user to home page
         return redirect("/")
@@ -215,15 +321,18 @@ def logout():
     return redirect("/")
 
 @app.route("/quote", methods=["GET", "POST"])
+@rate_limited
 @login_required
 def quote():
     """Get stock quote."""
     stocks = {}
     if request.method == "POST":
-        if not request.form.get("symbol"):
+        symbol = normalize_symbol(request.form.get("symbol") or "")
+        if not symbol:
+            return redirect("/quote", 400)
+        if not symbol_index.is_listed(symbol):
             return redirect("/quote", 400)
-        symbol = request.form.get("symbol")
-        stocks = lookup(symbol)
+        stocks = quote_deadlines.lookup(symbol)
         if not stocks:
             return redirect("/quote", 400)
 
@@ -232,6 +341,95 @@ def quote():
     return render_template("quote.html", stocks=stocks
                            )
 
+def leaderboard_etag():
+    return current_user.id, leaderboard.snapshot().computed_at
+
+
+@app.route("/leaderboard")
+@login_required
+@etag_cached(leaderboard_etag)
+def leaderboard_page():
+    """Rank every account by total value, from the cached snapshot"""
+    snapshot = leaderboard.snapshot()
+    return render_template("leaderboard.html", snapshot=snapshot, leaders=snapshot.top,
+                           mine=snapshot.entry(current_user.id),
+                           updated=datetime.fromtimestamp(snapshot.computed_at))
+
+@app.route("/symbols")
+@login_required
+def symbols():
+    """Autocomplete symbols by ticker or company name prefix"""
+    limit = request.args.get("limit", app.config["SYMBOL_SEARCH_LIMIT"], type=int)
+    limit = max(1, min(limit, app.config["SYMBOL_SEARCH_MAX_LIMIT"]))
+
+    response = jsonify(symbol_index.search(request.args.get("q", ""), limit))
+    # The listing rarely changes, so let the browser reuse answers while the user types
+    response.headers["Cache-Control"] = "private, max-age=3600"
+    return response
+
+# Chart ranges in days (None for the full history)
+CHART_RANGES = {"1m": 30, "3m": 91, "6m": 182, "1y": 365, "5y": 1826, "max": None}
+
+
+@app.route("/chart/<symbol>")
+@rate_limited
+@login_required
+def chart(symbol):
+    """Daily closing prices for symbol as JSON, downsampled to at most CHART_MAX_POINTS"""
+    symbol = symbol.upper()
+    if not SYMBOL_PATTERN.fullmatch(symbol):
+        return jsonify(error="invalid symbol"), 400
+
+    range_name = request.args.get("range", "1y")
+    if range_name not in CHART_RANGES:
+        return jsonify(error=f"range must be one of {', '.join(CHART_RANGES)}"), 400
+
+    points = request.args.get("points", app.config["CHART_MAX_POINTS"], type=int)
+    points = max(3, min(points, app.config["CHART_MAX_POINTS"]))
+
+    days = CHART_RANGES[range_name]
+    start = int(time.time()) - days * 86400 if days else None
+    try:
+        history = price_history.history(symbol, start)
+    except HistoryUnavailable:
+        return jsonify(error="price history is unavailable right now, try again later"), 502
+    if len(history["time"]) == 0:
+        return jsonify(error="no price history available"), 404
+
+    times, closes = lttb(history["time"], history["close"], points)
+    return jsonify(
+        symbol=symbol,
+        range=range_name,
+        time=times.astype("int64").tolist(),
+        close=closes.round(2).tolist(),
+    )
+
+@app.route("/stream/quotes")
+@rate_limited
+@login_required
+def stream_quotes():
+    """Push price updates for ?symbols=AAPL,MSFT as Server-Sent Events"""
+    symbols = {normalize_symbol(symbol) for symbol in request.args.get("symbols", "").split(",") if symbol.strip()}
+    if not symbols or len(symbols) > quote_feed.max_symbols:
+        return jsonify(error=f"provide between 1 and {quote_feed.max_symbols} symbols"), 400
+    unlisted = sorted(symbol for symbol in symbols if not symbol_index.is_listed(symbol))
+    if unlisted:
+        return jsonify(error=f"unknown symbols: {', '.join(unlisted)}"), 400
+
+    subscription = quote_feed.subscribe(symbols)
+    if subscription is None:
+        return jsonify(error="too many open streams, try again later"), 503, {"Retry-After": "30"}
+
+    # The generator runs after this request's context (and DB session) is released
+    response = Response(
+        quote_feed.stream(subscription),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # The generator's own cleanup never runs if its body is never iterated (HEAD, clients gone before the first chunk)
+    response.call_on_close(lambda: quote_feed.unsubscribe(subscription))
+    return response
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     """Register user"""
@@ -249,8 +447,8 @@ def register():
         confirmation = request.form.get("confirmation")
 
         # Check if the username already exists using the ORM
-        existing_user = db.session.query(User).filter(User.username == username).first()
-        if existing_user:
+        existing_id = db.session.scalar(sa.select(User.id).where(User.username == username))
+        if existing_id is not None:
             flash("username is not available", "failure")
             return redirect("/register", 400)
 
@@ -262,24 +460,16 @@ def register():
         # Hash the password
         hashed_password = generate_password_hash(password)
 
-        # Create a new user using the ORM
+        # Create a new user using the ORM, snapshotting it before the commit expires its attributes
         new_user = User(username=username, password_hash=hashed_password)
         db.session.add(new_user)
+        db.session.flush()
+        record_entry(new_user.id, "opening", new_user.cash)
+        snapshot = identity.remember(new_user)
         db.session.commit()
 
-        # Fetch the newly created user to get their ID
-        user = db.session.query(User).filter(User.username == username).first()
-        if not user:
-            flash("registration failed", "failure")
-            return redirect("/register", 400)
-
         # Remember which user has logged in
-        current_user = db.session.scalar(sa.Select(User).where(User.username == username))
-        if current_user is None or not current_user.check_password(password):
-            flash('Error retrieving details', 'danger')
-            return redirect(url_for('login'))
-
-        login_user(current_user)
+        login_user(snapshot)
         # Redirect to home page after successful registration
         return redirect("/")
 
@@ -287,36 +477,13 @@ def register():
     return render_template("register.html")
 
 @app.route("/sell", methods=["GET", "POST"])
+@rate_limited
 @login_required
+@etag_cached(portfolio_etag)
 def sell():
     """Sell shares of stock"""
     user_id = current_user.id
-
-    # Fetch the username using the ORM
-    user = db.session.get(User, user_id)
-    username = user.username if user else "Unknown User"  # Fallback in case the user is not found
-
-    # Fetch the user's stock portfolio using the ORM
-    stocks_with_price = []
-    stocks = (
-        db.session.query(
-            StockPortfolio.stock_id,
-            sa.func.sum(StockPortfolio.quantity).label('total_quantity'),
-            sa.func.round(sa.func.avg(StockPortfolio.buy_price), 2).label('average_price')
-        )
-        .filter(StockPortfolio.user_id == user_id)
-        .group_by(StockPortfolio.stock_id)
-        .all()
-    )
-    for stock in stocks:
-        current_price = lookup(stock.stock_id)['price']
-        stock_data = {
-            "stock_id": stock.stock_id,
-            "total_quantity": stock.total_quantity,
-            "average_price": stock.average_price,
-            "current_price": current_price,
-        }
-        stocks_with_price.append(stock_data)
+    username = current_user.username
 
     # Update the databases respective to the sale
     if request.method == "POST":
@@ -329,66 +496,27 @@ def sell():
         if not stock_id or not quantity_to_sell or quantity_to_sell <= 0:
             return apology("valid quantity required", 400)
 
-        # Look up the stock to get the current price
-        stock_data = lookup(stock_id)
-        if not stock_data:
-            return apology("stock not found", 404)
-
-        sale_price = stock_data['price']
-
-        # Fetch the user's stock portfolio entries for the specified stock
-        stock_entries = (
-            db.session.query(StockPortfolio)
-            .filter(StockPortfolio.user_id == user_id, StockPortfolio.stock_id == stock_id)
-            .order_by(StockPortfolio.id)
-            .all()
-        )
-
-        if not stock_entries:
-            return apology("stock not found in portfolio", 404)
-
-        # Calculate the total quantity of the stock available
-        total_quantity_available = sum(entry.quantity for entry in stock_entries)
-
-        if total_quantity_available < quantity_to_sell:
-            return apology("not enough shares to sell", 400)
-
-        # Calculate the total sale price
-        total_sale_price = sale_price * quantity_to_sell
-
-        # Iterate through the stock entries to update or delete them
-        remaining_quantity_to_sell = quantity_to_sell
-        for entry in stock_entries:
-            if remaining_quantity_to_sell >= entry.quantity:
-                # Delete the entry if the entire quantity is sold
-                db.session.delete(entry)
-                remaining_quantity_to_sell -= entry.quantity
-            else:
-                # Update the entry if only part of the quantity is sold
-                entry.quantity -= remaining_quantity_to_sell
-                break
-
-        # Add a new transaction to the transaction history
-        transaction = TransactionHistory(
-            user_id=user_id,
-            stock_id=stock_id,
-            transaction_type='Sale',
-            quantity=quantity_to_sell,
-            price=sale_price
-        )
-        db.session.add(transaction)
-
-        # Update the user's cash balance
-        user.cash += total_sale_price
-
-        # Commit all changes to the database
-        db.session.commit()
+        # Queue the sale; it is priced at execution and only goes through if enough shares are held
+        try:
+            order_engine.execute(user_id, "sell", stock_id, quantity_to_sell)
+        except OrderRejected as e:
+            if e.reason == "unknown_symbol":
+                return apology("stock not found", 404)
+            return apology(e.message, 503 if e.reason == "timeout" else 400)
+        except TimeoutError:
+            flash(ORDER_PENDING_MESSAGE, "info")
+            return redirect("/history")
 
         # Redirect to the home page
         return redirect("/")
 
+    # Price every holding with one batched lookup, giving up after QUOTE_DEADLINE
+    positions = held_positions(user_id)
+    quotes = quote_deadlines.lookup_many([position.stock_id for position in positions])
+    valuation = value_positions(positions, quotes)
+
     # Render the sell template with the user's stock portfolio
-    return render_template("sell.html", username=username, stocks=stocks_with_price)
+    return render_template("sell.html", username=username, stocks=valuation.rows())
 
 @app.route("/account", methods=["GET", "POST"])
 @login_required
@@ -396,16 +524,13 @@ def account():
     """Manage user account settings"""
     user_id = current_user.id
 
-    # Fetch the user using the ORM
-    user = db.session.get(User, user_id)
-    if not user:
-        flash("User not found", "failure")
-        return redirect("/")
-
-    username = user.username
-    cash = user.cash
-
     if request.method == "POST":
+        # Fetch the user using the ORM, only needed to change cash or the password
+        user = db.session.get(User, user_id)
+        if not user:
+            flash("User not found", "failure")
+            return redirect("/")
+
         # Identify the form type
         form_type = request.form.get("form_type")
 
@@ -440,11 +565,14 @@ def account():
                 flash("Please enter a valid amount", "failure")
                 return redirect("/account")
 
-            # Update the user's cash balance
-            user.cash += add_amount
+            # Update the user's cash balance in place, so a trade executing meanwhile is not overwritten
+            db.session.execute(
+                sa.update(User).where(User.id == user.id).values(cash=User.cash + add_amount)
+            )
+            record_entry(user.id, "deposit", add_amount)
             db.session.commit()
             flash(f"Successfully added ${add_amount:.2f} to your account", "success")
             return redirect("/account")
 
     # Render the account page
-    return render_template("account.html", username=username, cash=cash)
\ No newline at end of file
+    return render_template("account.html", username=current_user.username, cash=account_state(user_id).cash)
\ No newline at end of file
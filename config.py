@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 class Config:
@@ -7,9 +8,111 @@ class Config:
     UPLOAD_FOLDER = os.path.join(basedir, 'app', 'data', 'uploads')
     MAX_CONTENT_LENGTH = 1 * 1024 * 1024
 
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app', 'data', 'finance.db')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
+        'sqlite:///' + os.path.join(basedir, 'app', 'data', 'finance.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False # Not setting this results in a performance warning
 
+    # SQLite tuning applied to every connection (see app/utils/database.py)
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',  # Readers don't block the writer or each other
+        'busy_timeout': 5000,  # Milliseconds to wait for a lock before "database is locked"
+        'synchronous': 'NORMAL',  # Safe with WAL, fsyncs only at checkpoints
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # Negative means KiB, so 64 MiB per connection
+    }
+    SQLITE_READ_POOL_SIZE = int(os.environ.get('SQLITE_READ_POOL_SIZE') or 8)
+    SQLITE_SERIALIZED_WRITER = True  # Send all writes through one BEGIN IMMEDIATE connection
+    SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': SQLITE_READ_POOL_SIZE, 'max_overflow': 4}
+    if SQLALCHEMY_DATABASE_URI in ('sqlite://', 'sqlite:///:memory:'):
+        # An in-memory database is one shared connection (StaticPool), which takes no pool size
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    # Market data provider: 'yfinance' for live quotes, 'replay' for offline load testing
+    # (recorded CSV file if set, otherwise a seeded random walk per symbol)
+    MARKET_DATA_PROVIDER = os.environ.get('MARKET_DATA_PROVIDER') or 'yfinance'
+    MARKET_DATA_REPLAY_FILE = os.environ.get('MARKET_DATA_REPLAY_FILE')
+    MARKET_DATA_SEED = int(os.environ.get('MARKET_DATA_SEED') or 0)
+    # Injected on every replay call to mimic upstream latency and failures
+    MARKET_DATA_LATENCY_MS = float(os.environ.get('MARKET_DATA_LATENCY_MS') or 0)
+    MARKET_DATA_LATENCY_JITTER_MS = float(os.environ.get('MARKET_DATA_LATENCY_JITTER_MS') or 0)
+    MARKET_DATA_ERROR_RATE = float(os.environ.get('MARKET_DATA_ERROR_RATE') or 0)
+
+    # Quote cache in front of helpers.lookup (seconds / number of symbols)
+    QUOTE_CACHE_TTL = int(os.environ.get('QUOTE_CACHE_TTL') or 60)
+    QUOTE_CACHE_SIZE = int(os.environ.get('QUOTE_CACHE_SIZE') or 1024)
+
+    # Background re-pricing of held symbols (always on with SHARED_QUOTES_ENABLED); keep both intervals below
+    # QUOTE_CACHE_TTL
+    PRICE_REFRESHER_ENABLED = os.environ.get('PRICE_REFRESHER_ENABLED', '').lower() in ('1', 'true', 'yes')
+    PRICE_REFRESH_INTERVAL = int(os.environ.get('PRICE_REFRESH_INTERVAL') or 30)
+    PRICE_REFRESH_HOT_INTERVAL = int(os.environ.get('PRICE_REFRESH_HOT_INTERVAL') or 10)
+    PRICE_REFRESH_HOT_COUNT = 20  # Most widely held symbols refreshed at the hot interval
+    PRICE_REFRESH_BATCH_SIZE = 50
+
+    # Quote table in shared memory, read by every worker process and written by one of them. Enabling it also
+    # turns on the price refresher, which keeps held symbols in the table; symbols nobody holds are still
+    # fetched by each worker that misses them, unless the writer happened to fetch them first
+    SHARED_QUOTES_ENABLED = os.environ.get('SHARED_QUOTES_ENABLED', '').lower() in ('1', 'true', 'yes')
+    SHARED_QUOTES_NAME = os.environ.get('SHARED_QUOTES_NAME') or 'finance-quotes'
+    SHARED_QUOTES_SLOTS = 4096  # Keep well above the number of symbols in use; probing gives up at 32 slots
+    SHARED_QUOTES_LOCK_FILE = os.environ.get('SHARED_QUOTES_LOCK_FILE') or \
+        os.path.join(tempfile.gettempdir(), SHARED_QUOTES_NAME + '.lock')
+
+    # Transactions per /history page (overridable with ?per_page= up to the maximum)
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_MAX_PAGE_SIZE = 500
+    HISTORY_EXPORT_BATCH_SIZE = 1000  # Rows fetched from the cursor and sent per chunk of an export
+
+    # Server-Sent Events quote stream (/stream/quotes)
+    QUOTE_STREAM_POLL_INTERVAL = 5  # Seconds between polls of the shared price feed
+    QUOTE_STREAM_HEARTBEAT = 15  # Seconds between keepalive comments on an idle stream
+    # Streams are closed after this many seconds and the browser reconnects. Each open stream holds a sync
+    # worker thread, so pages only open one once the user turns on live prices, and only while visible
+    QUOTE_STREAM_MAX_LIFETIME = 30
+    QUOTE_STREAM_MAX_CLIENTS = 1000
+    QUOTE_STREAM_MAX_SYMBOLS = 50  # Per client
+
+    # Order engine: orders arriving within the window are priced together and committed as one group
+    ORDER_BATCH_WINDOW_MS = 5
+    ORDER_MAX_BATCH = 100
+    ORDER_TIMEOUT = 30  # Seconds a view waits for its order to execute
+
+    # Quote, buy and sell pages give up on an upstream quote after QUOTE_DEADLINE seconds (0 waits indefinitely)
+    QUOTE_DEADLINE = float(os.environ.get('QUOTE_DEADLINE') or 5.0)
+    QUOTE_UPSTREAM_WORKERS = int(os.environ.get('QUOTE_UPSTREAM_WORKERS') or 32)  # Upstream calls in flight at once
+
+    # Local daily price history used by the chart endpoint
+    HISTORY_FOLDER = os.path.join(basedir, 'app', 'data', 'history')
+    HISTORY_REFRESH_INTERVAL = 3600  # Seconds between upstream checks for new bars per symbol
+    CHART_MAX_POINTS = 500  # Longer ranges are downsampled server-side to this many points
+
+    # Leaderboard of every account by total value, served from a snapshot rebuilt in the background
+    LEADERBOARD_REFRESH_INTERVAL = int(os.environ.get('LEADERBOARD_REFRESH_INTERVAL') or 300)
+    LEADERBOARD_SIZE = 100
+
+    # Symbol master used for autocomplete and to reject unknown symbols. Nothing is rejected until
+    # `flask load-symbols` has written the file (it is not shipped, and other listings may be dropped in its place)
+    SYMBOL_LISTING_FILE = os.environ.get('SYMBOL_LISTING_FILE') or os.path.join(basedir, 'app', 'data', 'symbols.csv')
+    SYMBOL_SEARCH_LIMIT = 10
+    SYMBOL_SEARCH_MAX_LIMIT = 50
+
+    # Token-bucket rate limits (requests per second, burst size) on the quote, trading, chart and stream routes
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    RATE_LIMIT_USER_RATE = float(os.environ.get('RATE_LIMIT_USER_RATE') or 2)
+    RATE_LIMIT_USER_BURST = int(os.environ.get('RATE_LIMIT_USER_BURST') or 30)
+    RATE_LIMIT_IP_RATE = float(os.environ.get('RATE_LIMIT_IP_RATE') or 5)
+    RATE_LIMIT_IP_BURST = int(os.environ.get('RATE_LIMIT_IP_BURST') or 60)
+    # Market data calls per second per process, shared by lookups, the price refresher, the quote stream and charts.
+    # Past it pages answer 503 with Retry-After rather than calling the provider.
+    UPSTREAM_BUDGET_RATE = float(os.environ.get('UPSTREAM_BUDGET_RATE') or 5)
+    UPSTREAM_BUDGET_BURST = int(os.environ.get('UPSTREAM_BUDGET_BURST') or 50)
+
+    # Per-request instrumentation exported on /metrics (no hooks are installed when disabled)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+    # Log requests slower than this with their SQL/upstream/render breakdown (unset to disable)
+    METRICS_SLOW_REQUEST_MS = float(os.environ['METRICS_SLOW_REQUEST_MS']) \
+        if os.environ.get('METRICS_SLOW_REQUEST_MS') else 500
+
     # # Configure session to use filesystem (instead of signed cookies)
     # SESSION_PERMANENT = False
     # SESSION_TYPE = "filesystem"
\ No newline at end of file
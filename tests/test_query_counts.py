@@ -0,0 +1,49 @@
+import os
+
+# The app is configured when it is imported, so these must be set first
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["MARKET_DATA_PROVIDER"] = "replay"
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+
+import pytest
+
+from app import app, db
+from app.cli import QUERY_BUDGETS
+from app.utils.database import StatementCounter, sqlite_tuning
+from app.utils.models import User
+
+
+@pytest.fixture(scope="module")
+def client():
+    with app.app_context():
+        db.create_all()
+        user = User(username="budget", cash=10000.0)
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+
+    client = app.test_client()
+    response = client.post("/login", data={"username": "budget", "password": "password"})
+    assert response.status_code == 302
+    # Some holdings and history, so the pages have rows to show
+    for symbol in ("AAPL", "MSFT"):
+        response = client.post("/buy", data={"symbol": symbol, "shares": "2"})
+        assert response.status_code == 302
+    response = client.post("/sell", data={"stock_id": "AAPL", "quantity": "1"})
+    assert response.status_code == 302
+
+    yield client
+
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.mark.parametrize("path, budget", QUERY_BUDGETS.items())
+def test_page_within_query_budget(client, path, budget):
+    client.get(path)  # Warm the identity and quote caches, as check-query-counts does
+    with app.app_context():
+        engines = [db.engine, sqlite_tuning.writer]
+    with StatementCounter(engines) as counter:
+        response = client.get(path)
+    assert response.status_code == 200
+    assert counter.count <= budget, f"{path} ran {counter.count} statements, budget {budget}"